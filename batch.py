@@ -0,0 +1,211 @@
+import os
+import sys
+import json
+import time
+import argparse
+import traceback
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# ============================================================
+# CONFIG
+# ============================================================
+
+# Mismos campos obligatorios que pide la interfaz
+CAMPOS_OBLIGATORIOS = [
+    ("titulo", "Título"),
+    ("introduccion", "Introducción"),
+    ("zip_path", "ZIP de Evidencias"),
+    ("logo_sup_izq", "Logo Superior Izquierdo"),
+    ("logo_sup_der", "Logo Superior Derecho"),
+    ("output_dir", "Carpeta de Salida"),
+]
+
+CAMPOS_RUTA = [
+    "zip_path",
+    "output_dir",
+    "imagen_portada",
+    "logo_sup_izq",
+    "logo_sup_der",
+    "logo_inf_izq",
+    "logo_inf_der",
+    "cache_dir",
+]
+
+
+# ============================================================
+# MANIFIESTO
+# ============================================================
+
+def cargar_manifiesto(ruta):
+    """
+    Lee el manifiesto de trabajos. Puede ser una lista de trabajos o un
+    objeto {"comun": {...}, "trabajos": [...]} donde "comun" se aplica a
+    todos (p. ej. los logos). Cada trabajo usa las mismas llaves que la
+    interfaz (titulo, introduccion, zip_path, output_dir, logo_sup_izq...).
+    Las rutas relativas se resuelven desde la carpeta del manifiesto.
+    """
+    with open(ruta, encoding="utf-8") as f:
+        contenido = json.load(f)
+
+    if isinstance(contenido, list):
+        comun, trabajos = {}, contenido
+    else:
+        comun, trabajos = contenido.get("comun", {}), contenido.get("trabajos", [])
+
+    base = os.path.dirname(os.path.abspath(ruta))
+    resultado = []
+    for i, trabajo in enumerate(trabajos, 1):
+        datos = dict(comun)
+        datos.update(trabajo)
+        for campo in CAMPOS_RUTA:
+            if datos.get(campo):
+                datos[campo] = os.path.normpath(os.path.join(base, datos[campo]))
+        datos.setdefault("nombre", datos.get("titulo") or f"trabajo_{i}")
+        resultado.append(datos)
+    return resultado
+
+
+def validar_trabajo(datos):
+    """Regresa la lista de problemas del trabajo (vacía si está bien)."""
+    errores = []
+    for campo, nombre in CAMPOS_OBLIGATORIOS:
+        valor = datos.get(campo)
+        if not valor or not str(valor).strip():
+            errores.append(f"El campo '{nombre}' es obligatorio.")
+
+    zip_path = datos.get("zip_path")
+    if zip_path:
+        if not zip_path.lower().endswith(".zip"):
+            errores.append("El archivo de evidencias debe ser formato .ZIP")
+        elif not os.path.isfile(zip_path):
+            errores.append(f"No existe el ZIP de evidencias: {zip_path}")
+
+    for campo in ["imagen_portada", "logo_sup_izq", "logo_sup_der", "logo_inf_izq", "logo_inf_der"]:
+        path = datos.get(campo)
+        if path and not path.lower().endswith((".png", ".jpg", ".jpeg")):
+            errores.append(f"El archivo de {campo} debe ser PNG o JPG.")
+    return errores
+
+
+# ============================================================
+# EJECUCIÓN
+# ============================================================
+
+def _ejecutar_trabajo(datos):
+    """Corre un trabajo dentro de un proceso del pool."""
+    import main as pipeline
+
+    os.makedirs(datos["output_dir"], exist_ok=True)
+    log_path = os.path.join(datos["output_dir"], "Memoria_Tecnica_Final.log")
+    inicio = time.perf_counter()
+
+    # La salida de cada trabajo va a su propio log para no mezclarse
+    # (los intermedios ya van a una carpeta temporal propia de cada corrida)
+    with open(log_path, "w", encoding="utf-8") as log, \
+            contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+        try:
+            zip_entrega = pipeline.main(datos)
+            # Con "perfiles" main regresa un ZIP por perfil
+            if isinstance(zip_entrega, list):
+                zips = [os.path.abspath(z) for z in zip_entrega]
+            else:
+                zips = os.path.abspath(zip_entrega)
+            return {
+                "nombre": datos["nombre"],
+                "ok": True,
+                "zip": zips,
+                "segundos": round(time.perf_counter() - inicio, 2),
+                "log": log_path,
+            }
+        except Exception as e:
+            traceback.print_exc()
+            return {
+                "nombre": datos["nombre"],
+                "ok": False,
+                "error": f"{type(e).__name__}: {e}",
+                "segundos": round(time.perf_counter() - inicio, 2),
+                "log": log_path,
+            }
+
+
+def procesar_lote(trabajos, workers=None):
+    """
+    Procesa los trabajos en paralelo, uno por proceso. Regresa los
+    resultados en el orden del manifiesto.
+    """
+    workers = max(1, min(workers or os.cpu_count() or 1, len(trabajos) or 1))
+    resultados = [None] * len(trabajos)
+
+    # Dos trabajos con la misma carpeta de salida se pisarían el ZIP
+    vistos = {}
+    pendientes = []
+    for i, datos in enumerate(trabajos):
+        errores = validar_trabajo(datos)
+        carpeta = os.path.normcase(os.path.abspath(datos.get("output_dir") or ""))
+        if datos.get("output_dir") and carpeta in vistos:
+            errores.append(f"Misma carpeta de salida que '{vistos[carpeta]}'.")
+        vistos.setdefault(carpeta, datos["nombre"])
+
+        if errores:
+            resultados[i] = {"nombre": datos["nombre"], "ok": False, "error": " ".join(errores), "segundos": 0}
+            print(f"❌ {datos['nombre']}: {resultados[i]['error']}")
+        else:
+            # Repartimos los núcleos entre los trabajos que corren a la vez
+            datos.setdefault("workers_imagenes", max(1, (os.cpu_count() or 1) // workers))
+            pendientes.append(i)
+
+    if not pendientes:
+        return resultados
+
+    print(f"🚀 Procesando {len(pendientes)} trabajo(s) con {workers} proceso(s)...")
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futuros = {pool.submit(_ejecutar_trabajo, trabajos[i]): i for i in pendientes}
+        for futuro in as_completed(futuros):
+            i = futuros[futuro]
+            try:
+                resultado = futuro.result()
+            except Exception as e:
+                # El proceso murió (p. ej. sin memoria)
+                resultado = {"nombre": trabajos[i]["nombre"], "ok": False,
+                             "error": f"{type(e).__name__}: {e}", "segundos": 0}
+            resultados[i] = resultado
+
+            if resultado["ok"]:
+                print(f"✅ {resultado['nombre']} ({resultado['segundos']} s): {resultado['zip']}")
+            else:
+                print(f"❌ {resultado['nombre']} ({resultado['segundos']} s): {resultado['error']}")
+
+    return resultados
+
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Genera varias memorias técnicas sin interfaz a partir de un manifiesto JSON."
+    )
+    parser.add_argument("manifiesto", help="JSON con la lista de trabajos")
+    parser.add_argument("-w", "--workers", type=int, default=None,
+                        help="Trabajos simultáneos (por defecto uno por núcleo)")
+    parser.add_argument("-r", "--reporte", default=None,
+                        help="Dónde guardar el resumen JSON del lote")
+    args = parser.parse_args(argv)
+
+    inicio = time.perf_counter()
+    trabajos = cargar_manifiesto(args.manifiesto)
+    resultados = procesar_lote(trabajos, args.workers)
+
+    ok = sum(1 for r in resultados if r["ok"])
+    print(f"\n📋 Lote terminado en {time.perf_counter() - inicio:.1f} s: "
+          f"{ok} correcto(s), {len(resultados) - ok} con error")
+
+    if args.reporte:
+        with open(args.reporte, "w", encoding="utf-8") as f:
+            json.dump(resultados, f, indent=2, ensure_ascii=False)
+
+    return 0 if ok == len(resultados) else 1
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(cli())
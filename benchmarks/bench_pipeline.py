@@ -0,0 +1,215 @@
+"""
+Benchmark de todo el pipeline (main.main) con evidencias sintéticas.
+
+Uso:
+    python benchmarks/bench_pipeline.py --escalas 100 1000 10000 --salida resultados.json
+
+Cada escenario corre en un intérprete nuevo para que el pico de memoria de
+uno no contamine al siguiente. Las etapas son las que main() registra en su
+Instrumentacion (clasificación, planificación, render, ensamblado, ZIP...,
+una por perfil cuando hay "perfiles"), cada una con las páginas y los bytes
+que produjo.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+from instrumentacion import Instrumentacion, memoria_pico_mb  # noqa: E402
+
+# Contadores de main() con lo que produce cada etapa: (páginas, bytes). Con
+# perfiles la etapa y sus contadores llevan el mismo sufijo ("render_pantalla",
+# "paginas_cuerpo_pantalla")
+SALIDAS_ETAPA = {
+    "render": ("paginas_cuerpo", "bytes_cuerpo"),
+    "ensamblado": ("paginas_reporte", "bytes_reporte"),
+    "zip_entrega": (None, "bytes_zip_entrega"),
+}
+
+
+# ============================================================
+# ESCENARIO (proceso hijo)
+# ============================================================
+
+def generar_logos(carpeta):
+    from PIL import Image
+
+    os.makedirs(carpeta, exist_ok=True)
+    rutas = {
+        "izq": os.path.join(carpeta, "logo_izq.png"),
+        "der": os.path.join(carpeta, "logo_der.png"),
+        "portada": os.path.join(carpeta, "portada.jpg"),
+    }
+    Image.new("RGB", (600, 200), (200, 30, 30)).save(rutas["izq"])
+    Image.new("RGB", (600, 200), (30, 120, 200)).save(rutas["der"])
+    Image.linear_gradient("L").resize((2400, 1600)).convert("RGB").save(rutas["portada"], quality=90)
+    return rutas
+
+
+def salidas_etapa(nombre, contadores):
+    """Páginas y bytes que produjo la etapa (None si no produce un archivo)."""
+    for base, (paginas, bytes_) in SALIDAS_ETAPA.items():
+        if nombre == base or nombre.startswith(base + "_"):
+            sufijo = nombre[len(base):]
+            return (
+                contadores.get(paginas + sufijo) if paginas else None,
+                contadores.get(bytes_ + sufijo),
+            )
+    return None, None
+
+
+def correr_escenario(pipeline, zip_path, trabajo, extra):
+    import fitz
+    import zipfile
+
+    logos = generar_logos(os.path.join(trabajo, "logos"))
+
+    # Los mismos campos que llena la interfaz
+    gui_data = {
+        "titulo": "Benchmark",
+        "info_extra": "Evidencias sintéticas",
+        "introduccion": "Reporte generado con evidencias sintéticas.\n  - Ubicación\n  - Mantenimiento",
+        "imagen_portada": logos["portada"],
+        "logo_sup_izq": logos["izq"],
+        "logo_sup_der": logos["der"],
+        "logo_inf_izq": logos["izq"],
+        "logo_inf_der": logos["der"],
+        "zip_path": zip_path,
+        "output_dir": os.path.join(trabajo, "entrega"),
+        # Caché fría por defecto: cada escenario mide la preparación completa
+        "cache_dir": os.path.join(trabajo, "cache"),
+    }
+    gui_data.update(extra)
+
+    instr = Instrumentacion()
+    inicio = time.perf_counter()
+    resultado = pipeline.main(gui_data, instrumentacion=instr)
+    total = time.perf_counter() - inicio
+
+    reporte_corrida = instr.reporte()
+    contadores = reporte_corrida["contadores"]
+    etapas = []
+    for etapa in reporte_corrida["etapas"]:
+        paginas, bytes_ = salidas_etapa(etapa["etapa"], contadores)
+        etapas.append(dict(etapa, paginas=paginas, bytes=bytes_))
+
+    # Con "perfiles" main() regresa un ZIP por perfil
+    entregas = []
+    for zip_entrega in resultado if isinstance(resultado, list) else [resultado]:
+        with zipfile.ZipFile(zip_entrega) as zf:
+            info = zf.getinfo("Reporte_Principal.pdf")
+            with fitz.open(stream=zf.read(info), filetype="pdf") as doc:
+                paginas = doc.page_count
+        entregas.append({
+            "zip": os.path.basename(zip_entrega),
+            "paginas": paginas,
+            "bytes_reporte": info.file_size,
+            "bytes_zip_entrega": os.path.getsize(zip_entrega),
+        })
+
+    return {
+        "segundos_total": round(total, 4),
+        "etapas": etapas,
+        "reporte_corrida": reporte_corrida,
+        "memoria_pico_mb": memoria_pico_mb(),
+        "entregas": entregas,
+        "paginas": entregas[0]["paginas"],
+        "bytes_reporte": entregas[0]["bytes_reporte"],
+        "bytes_zip_entrega": entregas[0]["bytes_zip_entrega"],
+    }
+
+
+# ============================================================
+# ORQUESTACIÓN
+# ============================================================
+
+def preparar_zip(carpeta, imagenes, semilla):
+    from generar_evidencias import generar_zip
+
+    ruta = os.path.join(carpeta, f"evidencias_{imagenes}_s{semilla}.zip")
+    if not os.path.exists(ruta):
+        print(f"🧪 Generando evidencias sintéticas ({imagenes} imágenes)...")
+        t = time.perf_counter()
+        resumen = generar_zip(ruta + ".tmp", imagenes, semilla)
+        os.replace(ruta + ".tmp", ruta)
+        print(f"   {resumen} en {time.perf_counter() - t:.1f} s")
+    return ruta
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del pipeline de MTEasyPDF")
+    parser.add_argument("--escalas", type=int, nargs="+", default=[100, 1000, 10000],
+                        help="Número de imágenes por escenario")
+    parser.add_argument("--repeticiones", type=int, default=1)
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--evidencias", default=os.path.join(tempfile.gettempdir(), "mteasypdf_bench"),
+                        help="Carpeta donde se guardan (y reutilizan) los ZIP generados")
+    parser.add_argument("--extra", default="{}",
+                        help='JSON que se agrega a gui_data, p. ej. \'{"dpi_imagenes": 150}\'')
+    parser.add_argument("--salida", default="resultados_benchmark.json")
+    parser.add_argument("--interno", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.interno:
+        # Modo hijo: correr un escenario y escribir el resultado en JSON
+        params = json.loads(args.interno)
+        # main registra las fuentes al importarse, relativo al cwd original
+        import main as pipeline
+        os.chdir(params["trabajo"])
+        resultado = correr_escenario(pipeline, params["zip_path"], params["trabajo"], params["extra"])
+        with open(params["resultado"], "w", encoding="utf-8") as f:
+            json.dump(resultado, f)
+        return
+
+    os.makedirs(args.evidencias, exist_ok=True)
+    extra = json.loads(args.extra)
+
+    reporte = {
+        "fecha": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "cpus": os.cpu_count(),
+        "extra": extra,
+        "escenarios": [],
+    }
+
+    for imagenes in args.escalas:
+        zip_path = preparar_zip(args.evidencias, imagenes, args.semilla)
+
+        for rep in range(args.repeticiones):
+            with tempfile.TemporaryDirectory(prefix="mteasypdf_run_") as trabajo:
+                params = {
+                    "zip_path": zip_path,
+                    "trabajo": trabajo,
+                    "extra": extra,
+                    "resultado": os.path.join(trabajo, "resultado.json"),
+                }
+                print(f"⏱️ Escenario {imagenes} imágenes (repetición {rep + 1})...")
+                # El hijo arranca en el mismo cwd para encontrar las fuentes
+                subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), "--interno", json.dumps(params)],
+                    cwd=os.getcwd(), check=True, stdout=subprocess.DEVNULL,
+                )
+                with open(params["resultado"], encoding="utf-8") as f:
+                    resultado = json.load(f)
+
+            resultado.update({"imagenes": imagenes, "repeticion": rep + 1})
+            reporte["escenarios"].append(resultado)
+            print(f"   {resultado['segundos_total']:.2f} s, {resultado['paginas']} páginas, "
+                  f"pico {resultado['memoria_pico_mb']['proceso']:.0f} MB")
+
+    with open(args.salida, "w", encoding="utf-8") as f:
+        json.dump(reporte, f, indent=2, ensure_ascii=False)
+    print(f"✅ Resultados guardados en {args.salida}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Genera ZIPs de evidencias sintéticos con la misma estructura de carpetas que
+espera clasificar_archivos:
+
+    Proyecto/
+      01 Generales/                 (se ignora)
+      02 Ubicacion/                 fotos de ubicación
+      03 Inventario/                PDFs de varias páginas
+      04 Mantenimiento/<sec>/<sub>/<grupo>/<categoria>/   fotos + PDFs
+      05 Implementacion/<sec>/<sub>/<grupo>/<categoria>/
+      06 Anexos/                    PDFs
+
+Cada foto es distinta (lleva su número dibujado) para que la caché de
+imágenes no falsee las mediciones.
+"""
+import io
+import random
+import zipfile
+
+from PIL import Image, ImageDraw
+from reportlab.pdfgen import canvas
+from reportlab.lib.pagesizes import A4
+
+# (ancho, alto, peso relativo): mezcla de capturas, fotos de celular y cámaras
+RESOLUCIONES = [
+    (1280, 720, 2),
+    (1920, 1080, 3),
+    (4000, 3000, 4),
+    (6000, 4000, 1),
+]
+
+CATEGORIAS = ["Antes", "Despues", "Pruebas", "Pantalla configuracion", "Evidencia general"]
+
+
+def _imagen_base(ancho, alto, semilla):
+    rnd = random.Random(semilla)
+    img = Image.linear_gradient("L").resize((ancho, alto)).convert("RGB")
+    draw = ImageDraw.Draw(img)
+    for _ in range(12):
+        x, y = rnd.randrange(ancho), rnd.randrange(alto)
+        r = rnd.randrange(ancho // 20, ancho // 4)
+        color = tuple(rnd.randrange(256) for _ in range(3))
+        draw.ellipse((x - r, y - r, x + r, y + r), fill=color)
+    return img
+
+
+class GeneradorImagenes:
+    """Reutiliza un fondo por resolución y le estampa un número distinto a cada foto."""
+
+    def __init__(self, semilla=0):
+        self.rnd = random.Random(semilla)
+        self._bases = {}
+        self._contador = 0
+
+    def siguiente(self):
+        ancho, alto, _ = self.rnd.choices(RESOLUCIONES, weights=[r[2] for r in RESOLUCIONES])[0]
+        if (ancho, alto) not in self._bases:
+            self._bases[(ancho, alto)] = _imagen_base(ancho, alto, ancho * alto)
+
+        self._contador += 1
+        img = self._bases[(ancho, alto)].copy()
+        draw = ImageDraw.Draw(img)
+        bloque = max(ancho // 30, 8)
+        for i, bit in enumerate(bin(self._contador)[2:]):
+            color = (255, 255, 255) if bit == "1" else (0, 0, 0)
+            draw.rectangle((i * bloque, 0, (i + 1) * bloque, bloque), fill=color)
+
+        buf = io.BytesIO()
+        img.save(buf, format="JPEG", quality=85)
+        return buf.getvalue()
+
+
+def generar_pdf(paginas, titulo):
+    buf = io.BytesIO()
+    c = canvas.Canvas(buf, pagesize=A4)
+    for i in range(paginas):
+        c.setFont("Helvetica", 14)
+        c.drawString(72, 760, f"{titulo} - página {i + 1}")
+        for j in range(40):
+            c.drawString(72, 720 - j * 16, f"Renglón {j + 1} de datos de inventario")
+        c.showPage()
+    c.save()
+    return buf.getvalue()
+
+
+def generar_zip(ruta_zip, imagenes=100, semilla=0):
+    """
+    Escribe un ZIP con aproximadamente `imagenes` fotos repartidas entre
+    ubicación y los árboles de mantenimiento/implementación. Regresa un
+    resumen con lo que se generó.
+    """
+    rnd = random.Random(semilla)
+    fotos = GeneradorImagenes(semilla)
+    raiz = "Proyecto Sintetico/"
+
+    n_ubicacion = max(2, imagenes // 50)
+    n_arbol = max(1, imagenes - n_ubicacion)
+
+    # Unas 8 fotos por categoría, 4 categorías por grupo, 3 grupos, 2 subsecciones
+    categorias_necesarias = max(1, n_arbol // 8)
+    resumen = {"imagenes": 0, "pdfs": 0, "secciones": 0}
+
+    with zipfile.ZipFile(ruta_zip, "w", zipfile.ZIP_STORED) as zf:
+        zf.writestr(raiz + "01 Generales/leeme.pdf", generar_pdf(1, "Generales"))
+
+        for i in range(n_ubicacion):
+            zf.writestr(f"{raiz}02 Ubicacion/{i + 1:03d} Vista {i + 1}.jpg", fotos.siguiente())
+            resumen["imagenes"] += 1
+
+        for i, paginas in enumerate([3, 12, 25]):
+            zf.writestr(f"{raiz}03 Inventario/Inventario {i + 1}.pdf", generar_pdf(paginas, f"Inventario {i + 1}"))
+            resumen["pdfs"] += 1
+
+        restantes = n_arbol
+        categoria_n = 0
+        for arbol in ["04 Mantenimiento", "05 Implementacion"]:
+            sec_n = 0
+            while restantes > 0 and categoria_n < categorias_necesarias * (1 if arbol.startswith("04") else 2):
+                sec_n += 1
+                resumen["secciones"] += 1
+                for sub in range(1, 3):
+                    for grupo in range(1, 4):
+                        for cat in rnd.sample(CATEGORIAS, 4):
+                            if restantes <= 0:
+                                break
+                            categoria_n += 1
+                            carpeta = (
+                                f"{raiz}{arbol}/{sec_n:02d} Sitio {sec_n}/"
+                                f"{sub:02d} Area {sub}/{grupo:02d} Equipo {grupo}/{cat}/"
+                            )
+                            for k in range(min(restantes, rnd.randint(4, 12))):
+                                zf.writestr(f"{carpeta}{k + 1:02d} Foto {k + 1}.jpg", fotos.siguiente())
+                                restantes -= 1
+                                resumen["imagenes"] += 1
+                            if rnd.random() < 0.2:
+                                zf.writestr(f"{carpeta}Reporte {categoria_n}.pdf", generar_pdf(2, "Reporte"))
+                                resumen["pdfs"] += 1
+
+        for i in range(3):
+            zf.writestr(f"{raiz}06 Anexos/Anexo {i + 1}.pdf", generar_pdf(i + 1, f"Anexo {i + 1}"))
+            resumen["pdfs"] += 1
+
+    return resumen
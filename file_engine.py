@@ -1,31 +1,250 @@
 import os
+import time
+import hashlib
 import zipfile
 import shutil
+import threading
+from functools import lru_cache
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
-def limpiar_temp(temp_dir):
-    if os.path.exists(temp_dir):
-        shutil.rmtree(temp_dir)
-    os.makedirs(temp_dir)
+# Rutas dentro del ZIP de evidencias: "zip://<ruta_zip>!/<miembro>"
+PREFIJO_ZIP = "zip://"
+SEPARADOR_ZIP = "!/"
 
-def extraer_zip(zip_path, temp_dir):
-    with zipfile.ZipFile(zip_path, "r") as zip_ref:
-        zip_ref.extractall(temp_dir)
+EXT_IMAGENES = (".jpg", ".jpeg", ".png")
 
-def obtener_carpeta_raiz(base_path):
-    carpetas = [
-        os.path.join(base_path, c)
-        for c in os.listdir(base_path)
-        if os.path.isdir(os.path.join(base_path, c))
-    ]
-    return carpetas[0] if len(carpetas) == 1 else base_path
+# Extensiones por tipo de contenido (se comparan contra la extensión ya en
+# minúsculas, una sola vez por archivo)
+EXTENSIONES_IMAGEN = frozenset(EXT_IMAGENES)
+EXTENSIONES_INVENTARIO = frozenset((".xls", ".xlsx", ".pdf"))
+EXTENSIONES_PDF = frozenset((".pdf",))
+
+# Formatos que ya vienen comprimidos: deflate no gana nada y solo gasta CPU
+EXT_YA_COMPRIMIDOS = (
+    ".pdf", ".jpg", ".jpeg", ".png", ".gif", ".zip", ".7z", ".rar",
+    ".docx", ".xlsx", ".pptx", ".mp4", ".mov",
+)
+
+# ZipFile abiertos por (proceso, ruta): un hijo creado con fork no debe
+# compartir el descriptor (y la posición de lectura) del proceso padre.
+_zips_abiertos = {}
+_usos_zips = {}
+_lock_zips = threading.Lock()
+
+# ============================================================
+# ACCESO A ARCHIVOS (disco o miembros del ZIP)
+# ============================================================
+def ruta_en_zip(zip_path, miembro):
+    return f"{PREFIJO_ZIP}{zip_path}{SEPARADOR_ZIP}{miembro}"
+
+def es_ruta_zip(ruta):
+    return ruta.startswith(PREFIJO_ZIP)
+
+def separar_ruta_zip(ruta):
+    zip_path, _, miembro = ruta[len(PREFIJO_ZIP):].partition(SEPARADOR_ZIP)
+    return zip_path, miembro
+
+def _zip_abierto(zip_path):
+    clave = (os.getpid(), os.path.abspath(zip_path))
+    with _lock_zips:
+        if clave not in _zips_abiertos:
+            zf = zipfile.ZipFile(zip_path, "r")
+            # Algunos compresores de Windows guardan "\" en vez de "/"
+            miembros = {
+                info.filename.replace("\\", "/"): info
+                for info in zf.infolist()
+                if not info.is_dir()
+            }
+            _zips_abiertos[clave] = (zf, miembros)
+        return _zips_abiertos[clave]
+
+def abrir_zip(zip_path):
+    """
+    Marca el ZIP como en uso por una corrida. Varias corridas pueden leer el
+    mismo ZIP a la vez; el archivo se cierra cuando la última llama a
+    cerrar_zip.
+    """
+    # Primero se abre: si el ZIP está dañado no queda marcado como en uso
+    abierto = _zip_abierto(zip_path)
+    clave = (os.getpid(), os.path.abspath(zip_path))
+    with _lock_zips:
+        _usos_zips[clave] = _usos_zips.get(clave, 0) + 1
+    return abierto
+
+def cerrar_zip(zip_path):
+    clave = (os.getpid(), os.path.abspath(zip_path))
+    with _lock_zips:
+        usos = _usos_zips.get(clave, 0) - 1
+        if usos > 0:
+            _usos_zips[clave] = usos
+            return
+        _usos_zips.pop(clave, None)
+        abierto = _zips_abiertos.pop(clave, None)
+    if abierto:
+        abierto[0].close()
+
+def existe_archivo(ruta):
+    if es_ruta_zip(ruta):
+        zip_path, miembro = separar_ruta_zip(ruta)
+        return miembro in _zip_abierto(zip_path)[1]
+    return os.path.exists(ruta)
+
+def abrir_archivo(ruta):
+    """Abre en modo binario un archivo del disco o un miembro del ZIP (sin extraerlo)."""
+    if es_ruta_zip(ruta):
+        zip_path, miembro = separar_ruta_zip(ruta)
+        zf, miembros = _zip_abierto(zip_path)
+        return zf.open(miembros[miembro])
+    return open(ruta, "rb")
+
+def leer_archivo(ruta):
+    with abrir_archivo(ruta) as f:
+        return f.read()
+
+def nombre_base(ruta):
+    # Nombre del archivo sin carpetas, sea ruta de Windows, de Linux o del ZIP
+    return ruta.replace("\\", "/").rsplit("/", 1)[-1]
+
+def huella_archivo(ruta):
+    """
+    Huella del contenido de un archivo. Para los miembros del ZIP basta el
+    CRC y el tamaño del directorio central (no hay que leerlos); los del
+    disco se hashean. Regresa None si el archivo no existe.
+    """
+    if es_ruta_zip(ruta):
+        zip_path, miembro = separar_ruta_zip(ruta)
+        info = _zip_abierto(zip_path)[1].get(miembro)
+        return f"crc:{info.CRC:08x}:{info.file_size}" if info else None
+    return hash_contenido(ruta)
+
+def hash_contenido(ruta):
+    """
+    sha256 del contenido leído por bloques, del disco o de un miembro del
+    ZIP (sin extraerlo). Regresa None si no se puede leer.
+    """
+    h = hashlib.sha256()
+    try:
+        with abrir_archivo(ruta) as f:
+            for bloque in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(bloque)
+    except (OSError, KeyError):
+        return None
+    return "sha256:" + h.hexdigest()
+
+def tamano_archivo(ruta):
+    # Tamaño en bytes; los miembros del ZIP salen del directorio central
+    if es_ruta_zip(ruta):
+        zip_path, miembro = separar_ruta_zip(ruta)
+        return _zip_abierto(zip_path)[1][miembro].file_size
+    return os.path.getsize(ruta)
+
+def _nombre_libre(nombre, usados):
+    # "manual.pdf" -> "manual (2).pdf", "manual (3).pdf"... el primero libre
+    raiz, punto, ext = nombre.rpartition(".")
+    if not punto:
+        raiz, ext = nombre, ""
+    n = 2
+    candidato = nombre
+    while candidato.casefold() in usados:
+        candidato = f"{raiz} ({n}){punto}{ext}"
+        n += 1
+    return candidato
+
+def nombres_entrega(rutas, carpeta="anexos"):
+    """
+    Nombre que tendrá cada PDF dentro de `carpeta` en el ZIP de entrega.
+    Regresa {ruta: "carpeta/nombre"} solo para las rutas que existen.
+
+    - Los archivos con el mismo contenido (mismo tamaño y mismo sha256) se
+      entregan una sola vez y todas sus rutas apuntan a esa copia. Solo se
+      revisan los que comparten tamaño con otro, y de los miembros del ZIP
+      solo se leen los que además comparten CRC.
+    - Si dos contenidos distintos se llaman igual, el primero de `rutas`
+      conserva el nombre y los demás quedan como "nombre (2).pdf",
+      "nombre (3).pdf"... (la clasificación ya viene ordenada, así que el
+      resultado no cambia de una corrida a otra).
+      Se compara sin mayúsculas para que tampoco choquen al extraer el ZIP
+      en Windows.
+
+    Se calcula antes de dibujar: los links del reporte y el ZIP usan los
+    mismos nombres.
+    """
+    rutas = [r for r in dict.fromkeys(rutas) if existe_archivo(r)]
+
+    por_tamano = defaultdict(list)
+    for ruta in rutas:
+        por_tamano[tamano_archivo(ruta)].append(ruta)
+
+    contenido = {}
+    for tamano, grupo in por_tamano.items():
+        if len(grupo) == 1:
+            contenido[grupo[0]] = (tamano, grupo[0])
+            continue
+        por_huella = defaultdict(list)
+        for ruta in grupo:
+            por_huella[huella_archivo(ruta)].append(ruta)
+        for huella, iguales in por_huella.items():
+            for ruta in iguales:
+                # El CRC del ZIP solo descarta; si coincide se confirma con sha256
+                if len(iguales) > 1 and huella and huella.startswith("crc:"):
+                    contenido[ruta] = (tamano, hash_contenido(ruta) or ruta)
+                else:
+                    contenido[ruta] = (tamano, huella or ruta)
+
+    nombres = {}
+    por_contenido = {}
+    usados = set()
+    for ruta in rutas:
+        clave = contenido[ruta]
+        if clave not in por_contenido:
+            nombre = _nombre_libre(nombre_base(ruta), usados)
+            usados.add(nombre.casefold())
+            por_contenido[clave] = f"{carpeta}/{nombre}"
+        nombres[ruta] = por_contenido[clave]
+    return nombres
+
+def compresion_para(nombre):
+    if nombre.lower().endswith(EXT_YA_COMPRIMIDOS):
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+def escribir_zip_entrega(zip_path, entradas):
+    """
+    Escribe el ZIP de entrega copiando cada origen directo a su entrada, sin
+    carpeta intermedia. `entradas` es una lista de (nombre_en_zip, ruta) donde
+    la ruta puede estar en disco o dentro del ZIP de evidencias. Los formatos
+    ya comprimidos se guardan tal cual (STORED) y el resto con deflate.
+    """
+    fecha = time.localtime()[:6]
+    with zipfile.ZipFile(zip_path, "w") as zf:
+        for nombre, ruta in entradas:
+            info = zipfile.ZipInfo(nombre, date_time=fecha)
+            info.compress_type = compresion_para(nombre)
+            info.external_attr = 0o644 << 16
+            with abrir_archivo(ruta) as src, zf.open(info, "w", force_zip64=True) as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
 
+def obtener_raiz_zip(zip_path):
+    """
+    Carpeta raíz de las evidencias dentro del ZIP: la única carpeta de primer
+    nivel si solo hay una, o la raíz del ZIP. Solo lee el directorio central.
+    """
+    carpetas = set()
+    for miembro in _zip_abierto(zip_path)[1]:
+        partes = miembro.split("/")
+        if len(partes) > 1:
+            carpetas.add(partes[0])
+    if len(carpetas) == 1:
+        return ruta_en_zip(zip_path, carpetas.pop())
+    return ruta_en_zip(zip_path, "")
+
+@lru_cache(maxsize=None)
 def limpiar_nombre(nombre):
+    # Con miles de archivos por carpeta los mismos nombres se repiten mucho
     return nombre.replace("_", " ").replace("-", " ").replace(".", "").strip()
 
-def obtener_niveles(path, raiz):
-    rel = os.path.relpath(path, raiz)
-    partes = rel.split(os.sep)
+def _niveles_de_partes(partes):
     return {
         "seccion": limpiar_nombre(partes[0]) if len(partes) > 0 else None,
         "subseccion": limpiar_nombre(partes[1]) if len(partes) > 1 else None,
@@ -33,83 +252,194 @@ def obtener_niveles(path, raiz):
         "categoria": limpiar_nombre(partes[-2]) if len(partes) >= 2 else None,
     }
 
-def clasificar_archivos(base_path):
+def obtener_niveles(path, raiz):
+    if es_ruta_zip(path):
+        partes = path[len(raiz):].strip("/").split("/")
+    else:
+        rel = os.path.relpath(path, raiz)
+        partes = rel.split(os.sep)
+    return _niveles_de_partes(partes)
+
+# ============================================================
+# CLASIFICACIÓN
+# ============================================================
+def _extension(nombre):
+    base, punto, ext = nombre.rpartition(".")
+    return "." + ext.lower() if punto else ""
+
+def _tipo_carpeta(carpeta):
+    # A qué apartado del reporte pertenece una carpeta de primer nivel
+    nombre = carpeta.lower()
+    if nombre.startswith("01"):
+        return None
+    if nombre.startswith("02"):
+        return "ubicacion"
+    if nombre.startswith("03"):
+        return "inventario"
+    if "mantenimiento" in nombre or "implementacion" in nombre:
+        return "mantenimiento"
+    if "anexos" in nombre:
+        return "anexos"
+    return None
+
+def _carpetas_zip(raiz):
+    """
+    (carpetas, base, archivos) por cada carpeta bajo `raiz`, leyendo solo el
+    directorio central del ZIP: `carpetas` es la tupla de nombres desde la
+    raíz, `base` el prefijo de la ruta de sus archivos y `archivos` sus
+    nombres ordenados. Mismo orden que os.walk en Windows: carpeta por
+    carpeta, primero los archivos y luego las subcarpetas.
+    """
+    zip_path, prefijo = separar_ruta_zip(raiz)
+    prefijo = prefijo + "/" if prefijo else ""
+
+    por_carpeta = defaultdict(list)
+    for miembro in _zip_abierto(zip_path)[1]:
+        if not miembro.startswith(prefijo):
+            continue
+        carpeta, _, archivo = miembro[len(prefijo):].rpartition("/")
+        if carpeta:  # archivos sueltos en la raíz: igual que al extraer
+            por_carpeta[carpeta].append(archivo)
+
+    carpetas = sorted(por_carpeta, key=lambda c: c.split("/"))
+    return [
+        (tuple(c.split("/")), ruta_en_zip(zip_path, prefijo + c + "/"), sorted(por_carpeta[c]))
+        for c in carpetas
+    ]
+
+def _listar_carpeta(ruta):
+    archivos, carpetas = [], []
+    with os.scandir(ruta) as it:
+        for entrada in it:
+            if entrada.is_dir():
+                carpetas.append(entrada.name)
+            else:
+                archivos.append(entrada.name)
+    return sorted(archivos), sorted(carpetas)
+
+def _carpetas_disco(raiz, hilos=None):
+    """
+    Igual que _carpetas_zip para una carpeta en disco. Cada carpeta se lista
+    una sola vez con os.scandir; con `hilos` > 1 las carpetas de un mismo
+    nivel se listan en paralelo (ayuda en carpetas de red, donde cada
+    listado espera al servidor).
+    """
+    listados = {}
+    pendientes = [()]
+    pool = ThreadPoolExecutor(max_workers=hilos) if hilos and hilos > 1 else None
+    try:
+        while pendientes:
+            rutas = [os.path.join(raiz, *carpetas) for carpetas in pendientes]
+            resultados = pool.map(_listar_carpeta, rutas) if pool else map(_listar_carpeta, rutas)
+            siguientes = []
+            for carpetas, (archivos, subcarpetas) in zip(pendientes, resultados):
+                listados[carpetas] = (archivos, subcarpetas)
+                siguientes.extend(carpetas + (sub,) for sub in subcarpetas)
+            pendientes = siguientes
+    finally:
+        if pool:
+            pool.shutdown()
+
+    resultado = []
+
+    def recorrer(carpetas):
+        archivos, subcarpetas = listados[carpetas]
+        if carpetas:  # archivos sueltos en la raíz no cuentan
+            resultado.append((carpetas, os.path.join(raiz, *carpetas) + os.sep, archivos))
+        for sub in subcarpetas:
+            recorrer(carpetas + (sub,))
+
+    recorrer(())
+    return resultado
+
+def clasificar_archivos(base_path, hilos=None):
+    """
+    Recorre una sola vez las evidencias (el directorio central del ZIP o la
+    carpeta en disco) y reparte cada archivo por apartado según su carpeta
+    de primer nivel. Además de las listas regresa "niveles": para cada
+    archivo de mantenimiento, sus etiquetas ya limpias (sección,
+    subsección, grupo y categoría), calculadas una vez por carpeta, que
+    comparten build_mantenimiento_tree y los árboles de PDFs.
+
+    Nada se extrae del ZIP: las rutas apuntan a los miembros y se leen
+    cuando se necesitan. `hilos` solo aplica a carpetas en disco.
+    """
     resultado = {
         "ubicacion": [],
         "inventario": [],
         "mantenimiento": {"imagenes": [], "pdfs": []},
         "anexos": [],
+        "niveles": {},
     }
 
-    for carpeta in os.listdir(base_path):
-        ruta_carpeta = os.path.join(base_path, carpeta)
-        if not os.path.isdir(ruta_carpeta):
-            continue
+    if es_ruta_zip(base_path):
+        carpetas_evidencia = _carpetas_zip(base_path)
+    else:
+        carpetas_evidencia = _carpetas_disco(base_path, hilos)
 
-        nombre = carpeta.lower()
+    niveles = resultado["niveles"]
+    tipos = {}
+    for carpetas, base, archivos in carpetas_evidencia:
+        if carpetas[0] not in tipos:
+            tipos[carpetas[0]] = _tipo_carpeta(carpetas[0])
+        tipo = tipos[carpetas[0]]
 
-        if nombre.startswith("01"):
-            continue
+        if tipo == "ubicacion":
+            resultado["ubicacion"].extend(
+                base + f for f in archivos if _extension(f) in EXTENSIONES_IMAGEN
+            )
 
-        if nombre.startswith("02"):
-            for root, _, files in os.walk(ruta_carpeta):
-                for f in sorted(files):
-                    if f.lower().endswith((".jpg", ".jpeg", ".png")):
-                        resultado["ubicacion"].append(os.path.join(root, f))
-
-        elif nombre.startswith("03"):
-            for root, _, files in os.walk(ruta_carpeta):
-                for f in files:
-                    if f.lower().endswith((".xls", ".xlsx", ".pdf")):
-                        resultado["inventario"].append(os.path.join(root, f))
-
-        elif "mantenimiento" in nombre or "implementacion" in nombre:
-            for root, _, files in os.walk(ruta_carpeta):
-                for f in sorted(files):
-                    ruta = os.path.join(root, f)
-                    if f.lower().endswith((".jpg", ".jpeg", ".png")):
-                        resultado["mantenimiento"]["imagenes"].append(ruta)
-                    elif f.lower().endswith(".pdf"):
-                        resultado["mantenimiento"]["pdfs"].append(ruta)
-
-        elif "anexos" in nombre:
-            for root, _, files in os.walk(ruta_carpeta):
-                for f in sorted(files):
-                    if f.lower().endswith(".pdf"):
-                        resultado["anexos"].append(os.path.join(root, f))
+        elif tipo == "inventario":
+            resultado["inventario"].extend(
+                base + f for f in archivos if _extension(f) in EXTENSIONES_INVENTARIO
+            )
+
+        elif tipo == "anexos":
+            resultado["anexos"].extend(
+                base + f for f in archivos if _extension(f) in EXTENSIONES_PDF
+            )
+
+        elif tipo == "mantenimiento":
+            # Desde el tercer nivel las etiquetas ya no dependen del archivo
+            de_carpeta = _niveles_de_partes(carpetas + ("",)) if len(carpetas) >= 3 else None
+            for f in archivos:
+                ext = _extension(f)
+                if ext in EXTENSIONES_IMAGEN:
+                    destino = resultado["mantenimiento"]["imagenes"]
+                elif ext in EXTENSIONES_PDF:
+                    destino = resultado["mantenimiento"]["pdfs"]
+                else:
+                    continue
+                ruta = base + f
+                destino.append(ruta)
+                niveles[ruta] = de_carpeta or _niveles_de_partes(carpetas + (f,))
 
     return resultado
 
 
-def build_mantenimiento_tree(imagenes, raiz):
+def arbol_por_niveles(rutas, raiz, niveles=None):
+    """
+    Agrupa las rutas en sección > subsección > grupo > categoría. Con
+    `niveles` (el de clasificar_archivos) se usan las etiquetas ya
+    calculadas; si no, se obtienen de cada ruta.
+    """
     tree = defaultdict(
         lambda: defaultdict(lambda: defaultdict(lambda: defaultdict(list)))
     )
 
-    for img in imagenes:
-        niveles = obtener_niveles(img, raiz)
-        tree[niveles["seccion"]][niveles["subseccion"]][niveles["grupo"]][
-            niveles["categoria"]
-        ].append(img)
+    for ruta in rutas:
+        n = niveles[ruta] if niveles is not None else obtener_niveles(ruta, raiz)
+        tree[n["seccion"]][n["subseccion"]][n["grupo"]][n["categoria"]].append(ruta)
 
     return tree
 
 
-def agrupar_pdfs_por_categoria(pdfs, raiz):
-    pdf_tree = defaultdict(
-        lambda: defaultdict(lambda: defaultdict(lambda: defaultdict(list)))
-    )
-
-    for pdf in pdfs:
-        niveles = obtener_niveles(pdf, raiz)
-        pdf_tree[niveles["seccion"]][niveles["subseccion"]][niveles["grupo"]][
-            niveles["categoria"]
-        ].append(pdf)
-
-    return pdf_tree
+def build_mantenimiento_tree(imagenes, raiz, niveles=None):
+    return arbol_por_niveles(imagenes, raiz, niveles)
 
 def calcular_paginas_indice(mantenimiento_tree, data):
-    # Estimamos 35 líneas por página
+    # Estimamos 35 líneas por página (solo es el punto de partida:
+    # planificar_con_indice mide el índice exacto y corrige)
     lineas_por_pagina = 35
     
     # Iniciamos conteo con Ubicación, Inventario y Anexos
@@ -1,5 +1,6 @@
 import sys
 import os
+import multiprocessing
 
 import sys
 import os
@@ -42,6 +43,7 @@ from PyQt5.QtWidgets import (
     QScrollArea,
     QSizePolicy,
     QProgressBar,
+    QComboBox,
 )
 from PyQt5.QtCore import Qt, QThread, pyqtSignal
 
@@ -107,6 +109,11 @@ class MemoriaApp(QWidget):
         self.logo_inf_der = QLineEdit()
         self.logo_inf_izq = QLineEdit()
         self.output_folder = QLineEdit()
+        self.resolucion = QComboBox()
+        self.resolucion.addItem("Pantalla (150 DPI)", 150)
+        self.resolucion.addItem("Estándar (200 DPI)", 200)
+        self.resolucion.addItem("Impresión (300 DPI)", 300)
+        self.resolucion.setCurrentIndex(1)
 
         # Secciones
         form_layout.addWidget(self.section_title("Información General"))
@@ -140,6 +147,9 @@ class MemoriaApp(QWidget):
                 "Carpeta donde se guardará el ZIP *", self.output_folder
             )
         )
+        form_layout.addLayout(
+            self._row("Resolución de las imágenes", self.resolucion)
+        )
 
         scroll.setWidget(container)
         layout_principal.addWidget(scroll)
@@ -265,6 +275,7 @@ class MemoriaApp(QWidget):
             "logo_sup_der": self.logo_sup_der.text(),
             "logo_inf_izq": self.logo_inf_izq.text(),
             "logo_inf_der": self.logo_inf_der.text(),
+            "dpi_imagenes": self.resolucion.currentData(),
         }
 
         self.btn_generar.setEnabled(False)
@@ -305,6 +316,8 @@ class MemoriaApp(QWidget):
 
 
 if __name__ == "__main__":
+    # Necesario para el pool de procesos de imágenes en el ejecutable congelado
+    multiprocessing.freeze_support()
     app = QApplication(sys.argv)
     window = MemoriaApp()
     window.show()
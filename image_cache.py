@@ -0,0 +1,157 @@
+import os
+import hashlib
+import tempfile
+import threading
+
+# Carpeta y tamaño por defecto de la caché de imágenes ya preparadas
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".mteasypdf", "cache_imagenes")
+TAMANO_MAXIMO_MB = 2048
+
+# Subir este número cuando cambie la forma de preparar las imágenes,
+# así las entradas viejas dejan de coincidir.
+VERSION_CACHE = 3
+
+
+class CacheImagenes:
+    """
+    Caché en disco de las imágenes que genera prepare_image_for_pdf (con otra
+    `extension` sirve para otros resultados, p. ej. las secciones en PDF).
+
+    La clave es el hash del contenido del archivo más los parámetros de
+    codificación, así que renombrar o mover una foto no invalida su entrada.
+    Cuando la carpeta supera el tamaño máximo se borran las entradas menos
+    usadas recientemente (cada acierto actualiza la fecha del archivo).
+    """
+
+    def __init__(self, carpeta=CACHE_DIR, tamano_maximo_mb=TAMANO_MAXIMO_MB, extension=".jpg"):
+        self.carpeta = carpeta
+        self.extension = extension
+        self.tamano_maximo = int(tamano_maximo_mb * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+        self._tamano_actual = None
+        self._lock = threading.Lock()
+
+    def clave(self, contenido, **parametros):
+        h = hashlib.sha256(contenido)
+        extra = ";".join(f"{k}={parametros[k]}" for k in sorted(parametros))
+        h.update(f"|v{VERSION_CACHE}|{extra}".encode("utf-8"))
+        return h.hexdigest()
+
+    def ruta(self, clave):
+        # Dos niveles para no llenar una sola carpeta con miles de archivos
+        return os.path.join(self.carpeta, clave[:2], clave + self.extension)
+
+    def obtener(self, clave):
+        ruta = self.ruta(clave)
+        try:
+            with open(ruta, "rb") as f:
+                datos = f.read()
+            # Marcamos la entrada como usada recientemente (LRU)
+            os.utime(ruta, None)
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return datos
+
+    def guardar(self, clave, datos):
+        ruta = self.ruta(clave)
+        try:
+            os.makedirs(os.path.dirname(ruta), exist_ok=True)
+            # Escritura atómica: otro proceso nunca ve un archivo a medias
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(ruta), suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(datos)
+            os.replace(tmp, ruta)
+        except OSError as e:
+            print(f"⚠️ No se pudo escribir en la caché de imágenes: {e}")
+            return
+
+        with self._lock:
+            if self._tamano_actual is None:
+                self._tamano_actual = self._calcular_tamano()
+            else:
+                self._tamano_actual += len(datos)
+            excedido = self._tamano_actual > self.tamano_maximo
+
+        if excedido:
+            self.limpiar()
+
+    def _entradas(self):
+        entradas = []
+        for root, _, files in os.walk(self.carpeta):
+            for f in files:
+                if not f.endswith(self.extension):
+                    continue
+                ruta = os.path.join(root, f)
+                try:
+                    st = os.stat(ruta)
+                except OSError:
+                    continue
+                entradas.append((st.st_mtime, st.st_size, ruta))
+        return entradas
+
+    def _calcular_tamano(self):
+        return sum(tam for _, tam, _ in self._entradas())
+
+    def limpiar(self):
+        """Borra las entradas más antiguas hasta quedar bajo el 90% del límite."""
+        with self._lock:
+            entradas = sorted(self._entradas())
+            total = sum(tam for _, tam, _ in entradas)
+            objetivo = self.tamano_maximo * 0.9
+
+            for _, tam, ruta in entradas:
+                if total <= objetivo:
+                    break
+                try:
+                    os.remove(ruta)
+                    total -= tam
+                except OSError:
+                    pass
+
+            self._tamano_actual = total
+
+    def estadisticas(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "ratio": (self.hits / total) if total else 0.0,
+        }
+
+
+cache_imagenes = CacheImagenes()
+
+
+def cache_configurada(actual, carpeta, tamano_maximo_mb):
+    """
+    Regresa `actual` si ya usa esa carpeta y ese límite, o una caché nueva
+    (con la misma extensión) si no. Conservar la instancia hace que dos
+    corridas simultáneas en un proceso compartan su candado y contadores.
+    """
+    if (
+        actual.carpeta != carpeta
+        or actual.tamano_maximo != int(tamano_maximo_mb * 1024 * 1024)
+    ):
+        return CacheImagenes(carpeta, tamano_maximo_mb, extension=actual.extension)
+    return actual
+
+
+def configurar_cache(carpeta=None, tamano_maximo_mb=None):
+    """Cambia la carpeta o el límite de la caché global (p. ej. desde gui_data)."""
+    global cache_imagenes
+    cache_imagenes = cache_configurada(
+        cache_imagenes,
+        carpeta or CACHE_DIR,
+        tamano_maximo_mb if tamano_maximo_mb is not None else TAMANO_MAXIMO_MB,
+    )
+    return cache_imagenes
+
+
+def estadisticas_cache():
+    return cache_imagenes.estadisticas()
@@ -0,0 +1,122 @@
+import io
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import image_cache
+from pdf_utils import prepare_image_for_pdf, preparar_variantes
+
+
+def _iniciar_worker(carpeta_cache, tamano_cache_mb):
+    # Cada proceso usa la misma caché en disco que el proceso principal
+    image_cache.configurar_cache(carpeta_cache, tamano_cache_mb)
+
+
+def _preparar_en_worker(path, parametros):
+    cache = image_cache.cache_imagenes
+    hits, misses = cache.hits, cache.misses
+    datos = prepare_image_for_pdf(path, **parametros).getvalue()
+    # Regresamos también el efecto en la caché para sumarlo en el proceso principal
+    return datos, cache.hits - hits, cache.misses - misses
+
+
+def _preparar_variantes(path, variantes):
+    # Si la foto no se puede abrir, el render la reporta al dibujarla
+    cache = image_cache.cache_imagenes
+    hits, misses = cache.hits, cache.misses
+    try:
+        preparar_variantes(path, variantes)
+    except Exception:
+        pass
+    return cache.hits - hits, cache.misses - misses
+
+
+def preparar_en_cache(trabajos, workers=None):
+    """
+    Prepara cada foto con todas sus variantes (ver preparar_variantes) en
+    procesos separados y deja los resultados en la caché de imágenes; no
+    regresa nada. trabajos: lista de (path, [parametros, ...]).
+    """
+    workers = max(1, workers or os.cpu_count() or 1)
+    cache = image_cache.cache_imagenes
+
+    if workers == 1:
+        for path, variantes in trabajos:
+            _preparar_variantes(path, variantes)
+        return
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_iniciar_worker,
+        initargs=(cache.carpeta, cache.tamano_maximo / (1024 * 1024)),
+    ) as pool:
+        rutas = [path for path, _ in trabajos]
+        variantes = [v for _, v in trabajos]
+        for hits, misses in pool.map(_preparar_variantes, rutas, variantes, chunksize=4):
+            # En los procesos la caché cuenta aparte; lo sumamos aquí
+            cache.hits += hits
+            cache.misses += misses
+
+
+class PrefetchImagenes:
+    """
+    Prepara en procesos separados las imágenes que el plan va a dibujar,
+    en el mismo orden, manteniendo como máximo `ventana` trabajos en vuelo.
+    El hilo del canvas solo recibe los JPEG ya listos.
+
+    trabajos: lista ordenada de (path, parametros) tal como se van a pedir.
+    """
+
+    def __init__(self, trabajos, workers=None, ventana=None):
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.ventana = ventana or self.workers * 4
+        self._trabajos = deque(trabajos)
+        self._en_vuelo = deque()
+        self._pool = None
+
+        if self.workers > 1 and self._trabajos:
+            cache = image_cache.cache_imagenes
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=_iniciar_worker,
+                initargs=(cache.carpeta, cache.tamano_maximo / (1024 * 1024)),
+            )
+
+    def _llenar(self):
+        while self._trabajos and len(self._en_vuelo) < self.ventana:
+            path, parametros = self._trabajos.popleft()
+            futuro = self._pool.submit(_preparar_en_worker, path, parametros)
+            self._en_vuelo.append(((path, parametros), futuro))
+
+    def obtener(self, path, **parametros):
+        if self._pool is None:
+            return prepare_image_for_pdf(path, **parametros)
+
+        self._llenar()
+
+        if self._en_vuelo and self._en_vuelo[0][0] == (path, parametros):
+            _, futuro = self._en_vuelo.popleft()
+            self._llenar()
+            datos, hits, misses = futuro.result()
+
+            cache = image_cache.cache_imagenes
+            cache.hits += hits
+            cache.misses += misses
+            return io.BytesIO(datos)
+
+        # Pedido fuera de orden: lo resolvemos aquí mismo
+        return prepare_image_for_pdf(path, **parametros)
+
+    def cerrar(self):
+        if self._pool is not None:
+            for _, futuro in self._en_vuelo:
+                futuro.cancel()
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cerrar()
+        return False
@@ -0,0 +1,156 @@
+import os
+import sys
+import json
+import time
+from contextlib import contextmanager
+
+
+# ============================================================
+# MEMORIA
+# ============================================================
+
+def _contadores_windows():
+    import ctypes
+    from ctypes import wintypes
+
+    class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+        _fields_ = [
+            ("cb", wintypes.DWORD),
+            ("PageFaultCount", wintypes.DWORD),
+            ("PeakWorkingSetSize", ctypes.c_size_t),
+            ("WorkingSetSize", ctypes.c_size_t),
+            ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+            ("PagefileUsage", ctypes.c_size_t),
+            ("PeakPagefileUsage", ctypes.c_size_t),
+        ]
+
+    contadores = PROCESS_MEMORY_COUNTERS()
+    contadores.cb = ctypes.sizeof(contadores)
+    ctypes.windll.psapi.GetProcessMemoryInfo(
+        ctypes.windll.kernel32.GetCurrentProcess(),
+        ctypes.byref(contadores),
+        contadores.cb,
+    )
+    return contadores
+
+
+def memoria_pico_mb():
+    """Pico de memoria residente del proceso (y de sus hijos ya terminados)."""
+    if sys.platform == "win32":
+        pico = _contadores_windows().PeakWorkingSetSize
+        return {"proceso": round(pico / (1024 * 1024), 1), "hijos": None}
+
+    import resource
+    # ru_maxrss viene en KB en Linux y en bytes en macOS
+    escala = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return {
+        "proceso": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / escala, 1),
+        "hijos": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / escala, 1),
+    }
+
+
+def memoria_actual_mb():
+    """Memoria residente actual del proceso (None si no se puede saber)."""
+    if sys.platform == "win32":
+        return _contadores_windows().WorkingSetSize / (1024 * 1024)
+
+    try:
+        # Linux: segunda columna de statm = páginas residentes
+        with open("/proc/self/statm") as f:
+            residentes = int(f.read().split()[1])
+        return residentes * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+# ============================================================
+# INSTRUMENTACIÓN
+# ============================================================
+
+class Instrumentacion:
+    """
+    Registro de una corrida: cuánto tardó cada etapa de main(), cuánta
+    memoria se había usado al terminarla y contadores libres (imágenes,
+    bytes, páginas...). Las mediciones repetitivas (p. ej. por imagen) se
+    acumulan en `medir` como total/cantidad/máximo para no guardar miles
+    de entradas.
+
+    Cualquier objeto con los mismos métodos se puede pasar a main() en su
+    lugar (por ejemplo para mandar las métricas a otro lado).
+    """
+
+    def __init__(self):
+        self.inicio = time.time()
+        self.etapas = []
+        self.contadores = {}
+        self.mediciones = {}
+        self._etapa_actual = None
+
+    @contextmanager
+    def etapa(self, nombre):
+        anterior = self._etapa_actual
+        self._etapa_actual = nombre
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.etapas.append({
+                "etapa": nombre,
+                "segundos": round(time.perf_counter() - t, 4),
+                "memoria_pico_mb": memoria_pico_mb(),
+            })
+            self._etapa_actual = anterior
+
+    def contar(self, nombre, cantidad=1):
+        self.contadores[nombre] = self.contadores.get(nombre, 0) + cantidad
+
+    def medir(self, nombre, segundos):
+        m = self.mediciones.setdefault(nombre, {"cantidad": 0, "segundos": 0.0, "maximo": 0.0})
+        m["cantidad"] += 1
+        m["segundos"] += segundos
+        m["maximo"] = max(m["maximo"], segundos)
+
+    def sumar(self, contadores, mediciones):
+        """
+        Agrega contadores y mediciones tomados en otro proceso (p. ej. los
+        tramos que se dibujan en paralelo), con el mismo formato que
+        self.contadores y self.mediciones.
+        """
+        for nombre, cantidad in contadores.items():
+            self.contar(nombre, cantidad)
+        for nombre, otra in mediciones.items():
+            m = self.mediciones.setdefault(nombre, {"cantidad": 0, "segundos": 0.0, "maximo": 0.0})
+            m["cantidad"] += otra["cantidad"]
+            m["segundos"] += otra["segundos"]
+            m["maximo"] = max(m["maximo"], otra["maximo"])
+
+    def reporte(self):
+        return {
+            "inicio": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.inicio)),
+            "segundos_total": round(time.time() - self.inicio, 4),
+            "memoria_pico_mb": memoria_pico_mb(),
+            "etapas": self.etapas,
+            "contadores": self.contadores,
+            "mediciones": {
+                nombre: {
+                    "cantidad": m["cantidad"],
+                    "segundos": round(m["segundos"], 4),
+                    "promedio": round(m["segundos"] / m["cantidad"], 6) if m["cantidad"] else 0.0,
+                    "maximo": round(m["maximo"], 6),
+                }
+                for nombre, m in self.mediciones.items()
+            },
+        }
+
+    def guardar(self, ruta):
+        with open(ruta, "w", encoding="utf-8") as f:
+            json.dump(self.reporte(), f, indent=2, ensure_ascii=False)
+        return ruta
+
+
+def ruta_reporte(zip_entrega):
+    """El reporte de la corrida va junto al ZIP de entrega."""
+    return os.path.splitext(zip_entrega)[0] + "_reporte.json"
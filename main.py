@@ -1,39 +1,58 @@
-import zipfile
 import os
-import re
 import sys
 import shutil
-from PyPDF2 import PdfMerger, PdfReader, PdfWriter
-from collections import defaultdict
+import tempfile
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import A4
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 
 from pdf_utils import (
-    draw_images,
     build_pdf_tree,
-    MARGIN,
+    streams_binarios,
 )
 
-from pdf_layout import (
-    draw_cover,
-    draw_header_footer,
-    draw_section_title,
-    draw_subsection_title,
-    nueva_pagina_con_titulo,
-    draw_index,
-    draw_introduccion,
-    render_documentacion_links
+from pdf_plan import (
+    planificar_con_indice,
+    asignar_presupuestos,
+    preparar_perfiles,
+    ejecutar_plan,
+)
+
+from pdf_registry import RegistroDocumentos
+from pdf_assembly import (
+    ensamblar_documento,
+    LOTE_PAGINAS,
+)
+
+from image_cache import (
+    configurar_cache,
+    estadisticas_cache,
+)
+
+from pdf_incremental import (
+    RenderIncremental,
+    configurar_cache_secciones,
+    construir_manifiesto,
+    cargar_manifiesto,
+    guardar_manifiesto,
+    comparar_manifiestos,
+    ruta_manifiesto,
+)
+
+from instrumentacion import (
+    Instrumentacion,
+    ruta_reporte,
 )
 
 from file_engine import (
-    limpiar_temp,
-    extraer_zip,
-    obtener_carpeta_raiz,
+    obtener_raiz_zip,
+    abrir_zip,
     clasificar_archivos,
+    escribir_zip_entrega,
+    nombres_entrega,
+    cerrar_zip,
     build_mantenimiento_tree,
-    agrupar_pdfs_por_categoria,
     calcular_paginas_indice,
 )
 
@@ -43,7 +62,6 @@ from file_engine import (
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 ZIP_PATH = "ejemplo.zip"
-TEMP_DIR = "temp"
 project_data = {}
 PAGE_WIDTH, PAGE_HEIGHT = A4
 
@@ -85,188 +103,6 @@ def imprimir_resumen(data):
     print("📎 Anexos:", len(data["anexos"]), "pdf(s)")
 
 
-def render_mantenimiento(
-    canvas,
-    cursor_y,
-    tree,
-    pdf_tree,
-    project_data,
-    index=None,
-    insert_tasks=None,
-):
-    MIN_BOTTOM = 120
-    TITLE_GAP = 2
-    hubo_contenido = False
-
-    # Convertimos a listas para saber el total y usar índices
-    secciones_list = list(tree.items())
-    total_secciones = len(secciones_list)
-
-    for i_sec, (seccion, subsecciones) in enumerate(secciones_list):
-        cursor_y = nueva_pagina_con_titulo(canvas, project_data, seccion)
-        if index:
-            index.add(seccion, canvas.getPageNumber(), level=1)
-        cursor_y -= TITLE_GAP
-
-        subsecciones_list = list(subsecciones.items())
-        total_subs = len(subsecciones_list)
-
-        for i_sub, (subseccion, grupos) in enumerate(subsecciones_list):
-            if subseccion:
-                if cursor_y < (MIN_BOTTOM + 40):
-                    canvas.showPage()
-                    draw_header_footer(canvas, canvas.getPageNumber(), project_data)
-                    cursor_y = PAGE_HEIGHT - 100
-                    cursor_y = draw_section_title(canvas, seccion, cursor_y)
-
-                cursor_y = draw_subsection_title(canvas, subseccion, cursor_y)
-                if index:
-                    index.add(subseccion, canvas.getPageNumber(), level=2)
-                cursor_y -= TITLE_GAP
-
-            grupos_list = list(grupos.items())
-            total_grupos = len(grupos_list)
-
-            for i_gru, (grupo, categorias) in enumerate(grupos_list):
-                if grupo:
-                    if cursor_y < (MIN_BOTTOM + 40):
-                        canvas.showPage()
-                        draw_header_footer(canvas, canvas.getPageNumber(), project_data)
-                        cursor_y = PAGE_HEIGHT - 100
-                        cursor_y = draw_section_title(canvas, seccion, cursor_y)
-
-                    cursor_y = draw_subsection_title(canvas, grupo, cursor_y)
-                    if index:
-                        index.add(grupo, canvas.getPageNumber(), level=3)
-                    cursor_y -= TITLE_GAP
-
-                categorias_list = list(categorias.items())
-                total_cats = len(categorias_list)
-
-                for i_cat, (categoria, imagenes_nativas) in enumerate(categorias_list):
-                    imagenes_categoria = [f for f in imagenes_nativas if f.lower().endswith((".jpg", ".jpeg", ".png"))]
-                    
-                    if categoria:
-                        if cursor_y < (MIN_BOTTOM + 40):
-                            canvas.showPage()
-                            draw_header_footer(canvas, canvas.getPageNumber(), project_data)
-                            cursor_y = PAGE_HEIGHT - 100
-                            cursor_y = draw_section_title(canvas, seccion, cursor_y)
-
-                        cursor_y = draw_subsection_title(canvas, categoria, cursor_y)
-                        cursor_y -= TITLE_GAP
-
-                    nombre = (categoria or "").lower()
-                    layout = 2 if ("pantalla" in nombre or "pruebas" in nombre) else 4
-                    
-                    # Dibujamos imágenes
-                    imagenes_temp = imagenes_categoria[:]
-                    while imagenes_temp:
-                        if cursor_y < (MIN_BOTTOM + 250):
-                            canvas.showPage()
-                            draw_header_footer(canvas, canvas.getPageNumber(), project_data)
-                            cursor_y = PAGE_HEIGHT - 100
-                            cursor_y = draw_section_title(canvas, seccion, cursor_y)
-
-                        imagenes_temp, used_height = draw_images(
-                            canvas, imagenes_temp, per_page=layout, start_y=cursor_y
-                        )
-                        cursor_y -= used_height
-                        hubo_contenido = True
-
-                    # --- EL SALTO DE PÁGINA INTELIGENTE ---
-                    # Solo hacemos showPage si NO es la última categoría de la última subsección del último grupo
-                    es_el_final_absoluto = (
-                        (i_sec == total_secciones - 1) and 
-                        (i_sub == total_subs - 1) and 
-                        (i_gru == total_grupos - 1) and 
-                        (i_cat == total_cats - 1)
-                    )
-
-                    if not es_el_final_absoluto:
-                        if cursor_y < (PAGE_HEIGHT - 150):
-                            canvas.showPage()
-                            draw_header_footer(canvas, canvas.getPageNumber(), project_data)
-                            cursor_y = PAGE_HEIGHT - 100
-                            cursor_y = draw_section_title(canvas, seccion, cursor_y)
-              
-    return cursor_y
-
-
-def build_pdf(
-    filename, with_index, data, mantenimiento_tree, index_items=None, index=None
-):
-    # pageCompression=1 es genial para que no pese tanto
-    c = canvas.Canvas(filename, pagesize=A4, pageCompression=1)
-
-    # Solo necesitamos rastrear el cursor vertical, el número lo lleva el canvas
-    cursor_y = PAGE_HEIGHT - 100
-
-    # -------- PORTADA --------
-    # draw_cover internamente ya llama a draw_header_footer con None (sin número)
-    draw_cover(
-        c,
-        {
-            "titulo": project_data["titulo"],
-            "info_extra": project_data["info_extra"],
-            "imagen_portada": project_data["imagen_portada"],
-        },
-        project_data,
-    )
-
-    # -------- INTRODUCCIÓN --------
-    # Al salir de draw_cover ya hubo un showPage(), así que aquí estamos en la pág 2
-    draw_header_footer(c, c.getPageNumber(), project_data)
-    # Importante: draw_introduccion ahora recibe project_data para sus propios saltos
-    cursor_y = draw_introduccion(c, project_data["introduccion"], project_data)
-
-    # Preparamos para lo que sigue (Ubicación o Índice)
-    c.showPage()
-
-    # -------- ÍNDICE (solo si ya existe) --------
-    if with_index and index_items:
-        draw_header_footer(c, c.getPageNumber(), project_data)
-        # Eliminamos start_page, el layout ahora usa getPageNumber()
-        draw_index(c, index_items, project_data)
-        # draw_index ya termina con un showPage() interno
-
-    # -------- UBICACIÓN --------
-    imagenes_restantes = data["ubicacion"][:]
-
-    while imagenes_restantes:
-        # Dibujamos encabezado de la página actual de ubicación
-        draw_header_footer(c, c.getPageNumber(), project_data)
-
-        cursor_y = draw_section_title(c, "Ubicación")
-        cursor_y -= 20
-
-        # Si quieres que la ubicación aparezca en el índice:
-        if index:
-            index.add("Ubicación", c.getPageNumber(), level=1)
-
-        imagenes_restantes, used_height = draw_images(
-            c,
-            imagenes_restantes,
-            per_page=2,
-            start_y=cursor_y,
-        )
-
-        cursor_y -= used_height
-
-        # Si quedan más imágenes de ubicación, saltamos de página
-        if imagenes_restantes:
-            c.showPage()
-            cursor_y = PAGE_HEIGHT - 100
-
-    # -------- MANTENIMIENTO --------
-    # MODIFICADO: Solo enviamos y recibimos cursor_y
-    cursor_y = render_mantenimiento(
-        c, cursor_y, mantenimiento_tree, project_data, index=index
-    )
-
-    c.save()
-
-
 # ============================================================
 # MAIN
 # ============================================================
@@ -278,13 +114,16 @@ def resource_path(relative_path):
     return os.path.join(os.path.abspath("."), relative_path)
 
 
-def main(gui_data=None, callback_progreso=None):
+def main(gui_data=None, callback_progreso=None, instrumentacion=None):
 
     # ============================================================
     # PREPARACIÓN
     # ============================================================
     project_data = {}
 
+    # Tiempos, memoria y contadores por etapa; se guardan junto al ZIP
+    instr = instrumentacion or Instrumentacion()
+
     if gui_data:
         project_data.update(gui_data)
         ZIP_PATH = gui_data.get("zip_path")
@@ -298,367 +137,256 @@ def main(gui_data=None, callback_progreso=None):
 
     reportar(10) # 10% - Iniciando
 
-    limpiar_temp(TEMP_DIR)
-    extraer_zip(ZIP_PATH, TEMP_DIR)
-    
-    reportar(30) # 30% - Clasificando
-
-    raiz = obtener_carpeta_raiz(TEMP_DIR)
-    data = clasificar_archivos(raiz)
-
-    mantenimiento_tree = build_mantenimiento_tree(
-        data["mantenimiento"]["imagenes"], raiz
-    )
-    
-    pdf_tree = build_pdf_tree(
-        data["mantenimiento"]["pdfs"], raiz
-    )
-
-    pdfs_mantenimiento_tree = agrupar_pdfs_por_categoria(
-        data["mantenimiento"]["pdfs"], raiz
-    )
-
-    insert_tasks = []
-    
-    destino_base = gui_data.get("output_dir", "output") if gui_data else "output"
-
-
-    # ============================================================
-    # PRIMERA PASADA (Solo para recolectar el Índice)
-    # ============================================================
-    index = IndexCollector()
-    
-    if not os.path.exists("output"):
-        os.makedirs("output")
-
-    # Archivo temporal para medir distancias y páginas
-    c = canvas.Canvas("output/_tmp_recolector.pdf", pagesize=A4)
-    cursor_y = PAGE_HEIGHT - 100
-
-    # ---------------- PORTADA ----------------
-    draw_cover(c, project_data, project_data)
-    # Al salir de draw_cover, el canvas ya hizo un showPage() internamente
-
-    # ---------------- INTRODUCCIÓN ----------------
-    draw_header_footer(c, c.getPageNumber(), project_data)
-    # Importante: enviamos project_data para que draw_introduccion gestione sus propios saltos
-    cursor_y = draw_introduccion(c, project_data["introduccion"], project_data)
-    c.showPage()
-    
-    # --- Simulación de espacio para el Índice ---
-    num_paginas_idx = calcular_paginas_indice(mantenimiento_tree, data)
-    for _ in range(num_paginas_idx):
-        c.showPage()
-
-    # ---------------- UBICACIÓN ----------------
-    index.add("Ubicación", c.getPageNumber(), level=1)
-    imagenes_restantes = data["ubicacion"][:]
-
-    while imagenes_restantes:
-        draw_header_footer(c, c.getPageNumber(), project_data)
-        cursor_y = draw_section_title(c, "Ubicación")
-        cursor_y -= 20
-
-        # Mantenemos tu lógica de 1 o 2 imágenes
-        per_page = 1 if len(imagenes_restantes) == 1 else 2
-
-        imagenes_restantes, used_height = draw_images(
-            c,
-            imagenes_restantes,
-            per_page=per_page,
-            start_y=cursor_y,
-        )
-        cursor_y -= used_height
-
-        if imagenes_restantes:
-            c.showPage()
-            cursor_y = PAGE_HEIGHT - 100
-
-
-    # ---------------- INVENTARIO ----------------
-    if data["inventario"]:
-
-        for pdf in data["inventario"]:
-            # 1. Dibujamos la página del marcador (la que tendrá el encabezado)
-            c.showPage()
-            
-            # Si es el primer PDF del inventario, registramos la sección
-            if pdf == data["inventario"][0]:
-                index.add("Inventario", c.getPageNumber(), level=1)
-
-            # 2. SIMULACIÓN: Si el PDF tiene 5 páginas, el índice debe saltar 4 páginas más
-            # para que la siguiente sección no empiece en un número falso.
-            if os.path.exists(pdf):
-                reader_temp = PdfReader(pdf)
-                # Saltamos N-1 páginas porque la primera ya la creamos con showPage()
-                for _ in range(len(reader_temp.pages) - 1):
-                    c.showPage()
-
-    # ---------------- MANTENIMIENTO ----------------
-    # Esta es la función que limpiamos antes. Solo devuelve cursor_y.
-    cursor_y = render_mantenimiento(
-        c,
-        PAGE_HEIGHT - 100,  # Iniciamos cursor arriba
-        mantenimiento_tree,
-        pdfs_mantenimiento_tree,
-        project_data,
-        index=index,  # Aquí se recolectan niveles 1, 2 y 3
-        insert_tasks=None,  # En la primera pasada no necesitamos anotar tareas de reemplazo
-    )
-    
-    # --- DOCUMENTACIÓN TÉCNICA (links PDFs de mantenimiento) ---
-    cursor_y = render_documentacion_links(
-        c,
-        PAGE_HEIGHT - 100,
-        pdf_tree,          # ← PDFs que estaban dentro de mantenimiento
-        project_data,
-        index=index        # ← IMPORTANTE para que aparezca en el índice
+    # Caché de imágenes preparadas (se reutiliza entre pasadas y entre corridas)
+    configurar_cache(
+        project_data.get("cache_dir"), project_data.get("cache_max_mb")
     )
 
-
-    # ---------------- ANEXOS ----------------
-    # Aseguramos que los Anexos empiecen en página nueva
-    c.showPage()
-    index.add("Anexos", c.getPageNumber(), level=1)
-
-    # Opcional: puedes simular el listado de anexos si quieres que el índice sea ultra preciso
-    # pero normalmente es solo una página.
-
-    c.save()  # Guardamos para procesar el index.items
-
-    index_items = index.get_items()
-
-    # ============================================================
-    # SEGUNDA PASADA (Generación del PDF con Diseño y Marcadores)
-    # ============================================================
-    insert_tasks = []  # Aquí anotamos: "En la página X, va el PDF Y"
-
-    c = canvas.Canvas("output/mvp_imagenes.pdf", pagesize=A4, pageCompression=1)
-
-    # ---------------- PORTADA ----------------
-    draw_cover(c, project_data, project_data)
-
-    # ---------------- INTRODUCCIÓN ----------------
-    draw_header_footer(c, c.getPageNumber(), project_data)
-    # Pasamos project_data para que draw_introduccion maneje sus propios saltos de página
-    cursor_y = draw_introduccion(c, project_data["introduccion"], project_data)
-    c.showPage()
-
-    # ---------------- ÍNDICE ----------------
-    # Ya no calculamos start_page, draw_index usa getPageNumber() internamente
-    draw_header_footer(c, c.getPageNumber(), project_data)
-    draw_index(c, index_items, project_data)
-    # Al salir de draw_index ya se hizo un showPage()
-
-    # ---------------- UBICACIÓN ----------------
-    imagenes_restantes = data["ubicacion"][:]
-    while imagenes_restantes:
-        draw_header_footer(c, c.getPageNumber(), project_data)
-        cursor_y = draw_section_title(c, "Ubicación")
-        cursor_y -= 20
-
-        per_page = 1 if len(imagenes_restantes) == 1 else 2
-        imagenes_restantes, used_height = draw_images(
-            c, imagenes_restantes, per_page=per_page, start_y=cursor_y
-        )
-
-        if imagenes_restantes:
-            c.showPage()
-
-    # ---------------- INVENTARIO (Segunda Pasada) ----------------
-    for pdf in data["inventario"]:
-        c.showPage()
-        p_actual = c.getPageNumber()
-        draw_header_footer(c, p_actual, project_data)
-
-        # Anotamos la página donde inicia el PDF
-        insert_tasks.append((p_actual, pdf))
-
-        c.setFont(FUENTE_NEGRITA, 14)
-        c.drawString(MARGIN, PAGE_HEIGHT - 120, f"Documento: {os.path.basename(pdf)}")
-
-        # Avanzamos el contador para que la pág 10 sea realmente la 10
-        if os.path.exists(pdf):
-            reader_temp = PdfReader(pdf)
-            paginas_pdf = len(reader_temp.pages)
-
-            # Si el PDF tiene más de 1 página, creamos "huecos" en el canvas
-            for _ in range(paginas_pdf - 1):
-                c.showPage()
-                # Opcional: anotar que esta página es de relleno
-                # (aunque la lógica del writer que pondremos abajo lo detectará solo)
-
-    # ---------------- MANTENIMIENTO ----------------
-    render_mantenimiento(
-        c,
-        PAGE_HEIGHT - 100,
-        mantenimiento_tree,
-        pdfs_mantenimiento_tree,
-        project_data,
-        index=None,  # Ya no recolectamos, ya tenemos index_items
-        insert_tasks=insert_tasks,
-    )
-    
-    # --- DOCUMENTACIÓN TÉCNICA (links PDFs de mantenimiento) ---
-    cursor_y = render_documentacion_links(
-        c,
-        PAGE_HEIGHT - 100,
-        pdf_tree,
-        project_data,
-        index=None
+    # Modo de memoria acotada para reportes muy grandes: fotos por tramos
+    # y documento final escrito por lotes de páginas. "memoria_lote_mb" solo
+    # orienta el tamaño de esos lotes ("memoria_maxima_mb" es su nombre
+    # anterior; no era un tope para toda la corrida)
+    memoria_lote_mb = (
+        project_data.get("memoria_lote_mb") or project_data.get("memoria_maxima_mb")
     )
+    memoria_acotada = bool(project_data.get("memoria_acotada") or memoria_lote_mb)
 
+    reportar(30) # 30% - Clasificando
 
-    # ---------------- ANEXOS (Listado con Links) ----------------
-    c.showPage()
-    draw_header_footer(c, c.getPageNumber(), project_data)
-
-    cursor_y = draw_section_title(c, "Anexos del Proyecto", PAGE_HEIGHT - 100)
-    cursor_y -= 20
-
-    c.setFont(FUENTE_TEXTO, 12)
-    for pdf in data["anexos"]:
-        nombre = os.path.basename(pdf)
-        c.setFillColor("blue")
-        c.drawString(MARGIN + 20, cursor_y, f"• {nombre}")
+    # Todo lo que se abre o se crea desde aquí se libera en el finally,
+    # también si falla a la mitad (p. ej. un ZIP dañado)
+    carpeta_trabajo = None
+    registro = None
+    zip_abierto = False
 
-        # El link es relativo a la carpeta donde estará el PDF final
-        c.linkURL(
-            f"anexos/{nombre}", (MARGIN + 20, cursor_y, MARGIN + 350, cursor_y + 12)
+    try:
+        # Cada corrida trabaja en su propia carpeta temporal (cuerpo del PDF y
+        # reporte antes de comprimir), así varias corridas pueden ir en paralelo
+        carpeta_trabajo = tempfile.mkdtemp(
+            prefix="mteasypdf_", dir=project_data.get("carpeta_temporal")
         )
 
-        cursor_y -= 25
-        if cursor_y < 120:
-            c.showPage()
-            draw_header_footer(c, c.getPageNumber(), project_data)
-            cursor_y = PAGE_HEIGHT - 120
-
-    c.save()
-
-    print("Insertando archivos PDF y generando versión final...")
-
-    # Abrimos el lector principal
-    reader = PdfReader("output/mvp_imagenes.pdf")
-    writer = PdfWriter()
-
-    # Creamos el buscador de tareas (Página: Ruta_PDF)
-    tareas_dict = {p[0]: p[1] for p in insert_tasks}
+        # Cada PDF de inventario se abre una vez y lo comparten plan y unión final
+        registro = RegistroDocumentos()
+        abrir_zip(ZIP_PATH)
+        zip_abierto = True
+
+        # Se clasifica desde el directorio central del ZIP; las imágenes y PDFs
+        # se leen directamente de sus miembros cuando se dibujan (sin extraer)
+        with instr.etapa("clasificacion"):
+            raiz = obtener_raiz_zip(ZIP_PATH)
+            data = clasificar_archivos(raiz)
+
+            # Las etiquetas de cada archivo ya vienen calculadas en "niveles"
+            mantenimiento_tree = build_mantenimiento_tree(
+                data["mantenimiento"]["imagenes"], raiz, data["niveles"]
+            )
+
+            pdf_tree = build_pdf_tree(
+                data["mantenimiento"]["pdfs"], raiz, data["niveles"]
+            )
+
+            # Nombre de cada PDF en anexos/ del ZIP de entrega, sin repetidos
+            # y sin choques de nombre; el plan lo usa para los links
+            data["nombres_entrega"] = nombres_entrega(
+                data["anexos"] + data["mantenimiento"]["pdfs"]
+            )
+
+        instr.contar("imagenes_ubicacion", len(data["ubicacion"]))
+        instr.contar("imagenes_mantenimiento", len(data["mantenimiento"]["imagenes"]))
+        instr.contar("pdfs_inventario", len(data["inventario"]))
+        instr.contar("pdfs_mantenimiento", len(data["mantenimiento"]["pdfs"]))
+        instr.contar("pdfs_anexos", len(data["anexos"]))
+        repetidos = len(data["nombres_entrega"]) - len(set(data["nombres_entrega"].values()))
+        instr.contar("pdfs_repetidos_entrega", repetidos)
+        if repetidos:
+            print(f"📎 PDFs repetidos (se entregan una sola vez): {repetidos}")
+
+        destino_base = gui_data.get("output_dir", "output") if gui_data else "output"
+
+
+        # ============================================================
+        # PLANIFICACIÓN (paginación e índice sin dibujar)
+        # ============================================================
+        with instr.etapa("planificacion"):
+            # La estimación es solo el punto de partida: el índice se mide
+            # exacto y se replanifica si no cuadra
+            num_paginas_idx = calcular_paginas_indice(mantenimiento_tree, data)
+
+            plan, index, vueltas = planificar_con_indice(
+                data, mantenimiento_tree, pdf_tree, registro, IndexCollector, num_paginas_idx
+            )
+            index_items = index.get_items()
+        instr.contar("vueltas_planificacion", vueltas)
+
+        # ============================================================
+        # PERFILES DE SALIDA
+        # ============================================================
+        # Cada perfil (p. ej. "pantalla" a 150 DPI y "impresion" a 300 DPI)
+        # reemplaza campos del proyecto y genera su propio ZIP de entrega con
+        # el mismo plan. Sin "perfiles" se genera una sola entrega.
+        # Se comparten la clasificación, el plan y la lectura/decodificación
+        # de cada foto; remuestrear y codificar las fotos (lo que más tarda),
+        # el render y el ensamblado se hacen una vez por perfil.
+        perfiles = [
+            (perfil.get("nombre") or f"perfil_{i}", dict(project_data, **perfil))
+            for i, perfil in enumerate(project_data.get("perfiles") or [], 1)
+        ] or [(None, project_data)]
+
+        if len(perfiles) > 1:
+            # Cada foto se decodifica una vez y se codifica para todos los
+            # perfiles; el render de cada uno la encuentra en la caché
+            with instr.etapa("preparacion_perfiles"):
+                fotos = preparar_perfiles(plan, registro, [datos for _, datos in perfiles])
+            print(f"🖼️ {fotos} foto(s) preparadas para {len(perfiles)} perfiles")
+
+        entregas = []
+        for nombre_perfil, datos in perfiles:
+            sufijo = f"_{nombre_perfil}" if nombre_perfil else ""
+            if nombre_perfil:
+                print(f"\n📄 Perfil: {nombre_perfil}")
+
+            # Con peso objetivo (p. ej. el límite de un correo) cada foto
+            # recibe un máximo de bytes según el área de su celda
+            peso_objetivo_mb = datos.get("peso_objetivo_mb")
+            bytes_fotos = asignar_presupuestos(plan, registro, datos)
+            if peso_objetivo_mb:
+                print(f"🎯 Peso objetivo {peso_objetivo_mb} MB: "
+                      f"{bytes_fotos / (1024 * 1024):.1f} MB para fotos")
+                instr.contar("bytes_presupuesto_fotos" + sufijo, bytes_fotos)
+
+            # ============================================================
+            # RENDER (una sola pasada ejecutando el plan)
+            # ============================================================
+            with instr.etapa("render" + sufijo), streams_binarios():
+                cuerpo_path = os.path.join(carpeta_trabajo, f"cuerpo{sufijo}.pdf")
+                c = canvas.Canvas(cuerpo_path, pagesize=A4, pageCompression=1)
+
+                # Con "incremental" las secciones de mantenimiento que no cambiaron
+                # desde la corrida anterior se toman de la caché de secciones en
+                # lugar de dibujarse (se activa a mano: ocupa hasta 1 GB en disco).
+                # En modo de memoria acotada las fotos siempre van por tramos en
+                # PDFs aparte, para que el cuerpo solo lleve texto. Con más de un
+                # proceso (y "render_paralelo", activo por defecto) también van por
+                # tramos, para dibujarlos en paralelo.
+                incremental = None
+                reutilizar = bool(datos.get("incremental", False))
+                workers = max(1, datos.get("workers_imagenes") or os.cpu_count() or 1)
+                paralelo = datos.get("render_paralelo", True) and workers > 1
+                if reutilizar:
+                    configurar_cache_secciones(
+                        datos.get("cache_secciones_dir"),
+                        datos.get("cache_secciones_max_mb"),
+                    )
+                if reutilizar or memoria_acotada or paralelo:
+                    incremental = RenderIncremental(carpeta_trabajo, reutilizar=reutilizar)
+
+                # insert_tasks: "En la página X, va el PDF Y"
+                insert_tasks = ejecutar_plan(c, plan, datos, index_items, instr, incremental)
+
+                instr.contar("paginas_cuerpo" + sufijo, c.getPageNumber())
+                c.save()
+                instr.contar("bytes_cuerpo" + sufijo, os.path.getsize(cuerpo_path))
+
+            print("Insertando archivos PDF y generando versión final...")
+
+            output_path = os.path.join(carpeta_trabajo, f"Reporte_Principal{sufijo}.pdf")
+            with instr.etapa("ensamblado" + sufijo):
+                paginas_reporte = ensamblar_documento(
+                    cuerpo_path, insert_tasks, registro, output_path,
+                    incremental.superposiciones if incremental else (),
+                    lote_paginas=datos.get("lote_paginas", LOTE_PAGINAS) if memoria_acotada else None,
+                    memoria_lote_mb=memoria_lote_mb,
+                )
+            instr.contar("paginas_reporte" + sufijo, paginas_reporte)
+            instr.contar("bytes_reporte" + sufijo, os.path.getsize(output_path))
+            if peso_objetivo_mb and os.path.getsize(output_path) > peso_objetivo_mb * 1024 * 1024:
+                print(f"⚠️ El reporte pesa {os.path.getsize(output_path) / (1024 * 1024):.1f} MB, "
+                      f"más que el objetivo de {peso_objetivo_mb} MB")
+
+            # Aseguramos que la carpeta base exista
+            if not os.path.exists(destino_base):
+                os.makedirs(destino_base)
+
+            # --- PREPARACIÓN DE RUTAS ---
+            # Extraemos la ruta que eligió el usuario en la GUI
+            ruta_destino_usuario = gui_data.get("output_dir", "output") if gui_data else "output"
+
+            reportar(90) # 90% - Comprimiendo entrega
+            zip_entrega = os.path.join(ruta_destino_usuario, f"Memoria_Tecnica_Final{sufijo}.zip")
+
+            # --- CONTENIDO DEL ZIP DE ENTREGA ---
+            # Los anexos y la documentación se copian directo desde su origen al ZIP,
+            # con los nombres que ya usan los links (un PDF repetido va una sola vez).
+            with instr.etapa("zip_entrega" + sufijo):
+                anexos = {}
+                for pdf, nombre in data["nombres_entrega"].items():
+                    anexos.setdefault(nombre, pdf)
+
+                escribir_zip_entrega(
+                    zip_entrega,
+                    [("Reporte_Principal.pdf", output_path)] + sorted(anexos.items()),
+                )
+            instr.contar("anexos_entregados" + sufijo, len(anexos))
+            instr.contar("bytes_zip_entrega" + sufijo, os.path.getsize(zip_entrega))
+            entregas.append(zip_entrega)
+
+            # --- MANIFIESTO (qué cambió respecto a la corrida anterior) ---
+            if incremental:
+                instr.contar("tramos_reutilizados" + sufijo, len(incremental.reutilizadas))
+                instr.contar("tramos_regenerados" + sufijo, len(incremental.regeneradas))
+
+            # Solo sirve para comparar corridas incrementales: sin "incremental"
+            # no se deja ningún archivo junto al ZIP
+            if reutilizar:
+                print(f"🔁 Tramos reutilizados: {len(incremental.reutilizadas)} "
+                      f"de {len(incremental.tramos)}")
+                manifiesto = construir_manifiesto(datos, mantenimiento_tree, raiz, incremental)
+                manifiesto_path = ruta_manifiesto(zip_entrega)
+                anterior = cargar_manifiesto(manifiesto_path)
+                if anterior:
+                    campos, nodos = comparar_manifiestos(anterior, manifiesto)
+                    for campo in campos:
+                        print(f"   ✏️ Cambió el campo: {campo}")
+                    for nodo in nodos:
+                        print(f"   ✏️ Cambió: {nodo}")
+                try:
+                    guardar_manifiesto(manifiesto_path, manifiesto)
+                except OSError as e:
+                    print(f"⚠️ No se pudo guardar el manifiesto: {e}")
+    finally:
+        # --- LIMPIEZA (también si la corrida falla) ---
+        with instr.etapa("limpieza"):
+            # Cerrar el ZIP de evidencias (se leyó sin extraerlo) y los PDFs
+            if registro is not None:
+                registro.cerrar()
+            if zip_abierto:
+                cerrar_zip(ZIP_PATH)
+
+            # Los intermedios se van con la carpeta de trabajo
+            if carpeta_trabajo:
+                shutil.rmtree(carpeta_trabajo, ignore_errors=True)
+                print("🧹 Limpieza completada: carpeta de trabajo eliminada.")
+
+    stats = estadisticas_cache()
+    print(f"🗃️ Caché de imágenes: {stats['hits']} aciertos, {stats['misses']} fallos")
+    instr.contar("cache_aciertos", stats["hits"])
+    instr.contar("cache_fallos", stats["misses"])
 
-    # Mantenemos una lista de lectores para evitar cierres prematuros
-    lectores_externos = []
-    
-    # --- VARIABLE CLAVE PARA ELIMINAR HOJAS EN BLANCO ---
-    skip_until = -1 
-
-    for i, page in enumerate(reader.pages):
-        num_pdf = i + 1
-
-        # Si esta página es un "hueco" que creamos en el canvas, la saltamos
-        if num_pdf <= skip_until:
-            continue
-
-        if num_pdf in tareas_dict:
-            ruta_pdf_real = tareas_dict[num_pdf]
-            if os.path.exists(ruta_pdf_real):
-                print(f"-> Insertando: {os.path.basename(ruta_pdf_real)} (Sustituye pág {num_pdf})")
-
-                ext_reader = PdfReader(ruta_pdf_real)
-                lectores_externos.append(ext_reader)
-
-                # Insertamos todas las páginas del PDF real
-                for page_ext in ext_reader.pages:
-                    writer.add_page(page_ext)
-                
-                # --- LÓGICA DE SALTO ---
-                # Si el PDF real tiene 5 páginas y empezó en la 6, 
-                # el canvas generó la 7, 8, 9 y 10 como blancas.
-                # Esta línea le dice al bucle que ignore esas páginas del reader.
-                skip_until = num_pdf + len(ext_reader.pages) - 1
-                
-            else:
-                print(f"⚠️ Archivo no encontrado: {ruta_pdf_real}. Manteniendo marcador.")
-                writer.add_page(page)
-        else:
-            # Página normal (Introducción, Ubicación, Mantenimiento, etc.)
-            writer.add_page(page)
-            
-    # Aseguramos que la carpeta base exista
-    if not os.path.exists(destino_base):
-        os.makedirs(destino_base)
-
-    # --- PREPARACIÓN DE CARPETAS ---
-    # Extraemos la ruta que eligió el usuario en la GUI
-    ruta_destino_usuario = gui_data.get("output_dir", "output") if gui_data else "output"
-
-    # Construimos las rutas finales en esa carpeta
-    entrega_dir = os.path.join(ruta_destino_usuario, "Reporte_Final_Entrega")
-    reportar(90) # 90% - Comprimiendo entrega
-    zip_entrega = os.path.join(ruta_destino_usuario, "Memoria_Tecnica_Final.zip")
-    anexos_dir = os.path.join(entrega_dir, "anexos")
-
-    if os.path.exists(entrega_dir):
-        shutil.rmtree(entrega_dir)
-    os.makedirs(anexos_dir)
-
-    # --- ESCRITURA FINAL ---
-    output_path = os.path.join(entrega_dir, "Reporte_Principal.pdf")
-
-    # Copiamos metadatos básicos
-    if reader.metadata:
-        writer.add_metadata(reader.metadata)
-
-    with open(output_path, "wb") as f:
-        writer.write(f)
-
-    # --- COPIAR ANEXOS EXTERNOS ---
-    for pdf_anexo in data.get("anexos", []):
-        if os.path.exists(pdf_anexo):
-            shutil.copy(pdf_anexo, anexos_dir)
-            
-    # --- COPIAR DOCUMENTACIÓN DE MANTENIMIENTO ---
-    for seccion, subsecciones in pdf_tree.items():
-        for subseccion, grupos in subsecciones.items():
-            for grupo, categorias in grupos.items():
-                for categoria, pdfs in categorias.items():
-                    for pdf in pdfs:
-                        if os.path.exists(pdf):
-                            shutil.copy(pdf, anexos_dir)
-                            
-                            
-    with zipfile.ZipFile(zip_entrega, 'w', zipfile.ZIP_DEFLATED) as zipf:
-        for root, dirs, files in os.walk(entrega_dir):
-            for file in files:
-                rel_path = os.path.relpath(os.path.join(root, file), entrega_dir)
-                zipf.write(os.path.join(root, file), rel_path)
-
-    # --- BLOQUE DE LIMPIEZA FINAL OPTIMIZADO ---
     try:
-        # 1. Borrar la carpeta de trabajo donde se armó el reporte
-        if os.path.exists(entrega_dir):
-            shutil.rmtree(entrega_dir)
-            
-        # 2. Borrar la carpeta temp (donde se extrajo el ZIP original)
-        if os.path.exists(TEMP_DIR):
-            shutil.rmtree(TEMP_DIR)
-            
-        # 3. Borrar archivos PDF intermedios que ya están dentro del ZIP final
-        archivos_a_limpiar = [
-            "output/_tmp_recolector.pdf",
-            "output/mvp_imagenes.pdf"
-        ]
-        for archivo in archivos_a_limpiar:
-            if os.path.exists(archivo):
-                os.remove(archivo)
-                
-        print(f"🧹 Limpieza profunda completada. Solo queda el ZIP de entrega.")
-    except Exception as e:
-        print(f"⚠️ Nota: Algunos archivos temporales no pudieron borrarse: {e}")
+        print(f"📈 Reporte de la corrida: {instr.guardar(ruta_reporte(entregas[0]))}")
+    except OSError as e:
+        print(f"⚠️ No se pudo guardar el reporte de la corrida: {e}")
 
     reportar(100) # Indica a la interfaz que terminamos
-    return zip_entrega
-    
-    print(f"✅ Proceso completo. Carpeta generada en: {entrega_dir}")
+    # Con "perfiles" se regresa la lista de ZIPs (uno por perfil)
+    return entregas if project_data.get("perfiles") else entregas[0]
 
 
 if __name__ == "__main__":
-    main()
+    # Sin interfaz: python main.py manifiesto.json [--workers N] [--reporte lote.json]
+    import multiprocessing
+    from batch import cli
+
+    multiprocessing.freeze_support()
+    sys.exit(cli())
@@ -0,0 +1,295 @@
+import gc
+import re
+
+import fitz  # PyMuPDF
+
+from file_engine import (
+    existe_archivo,
+    nombre_base,
+)
+from instrumentacion import memoria_actual_mb
+
+# Páginas del cuerpo que se copian por lote en el modo de memoria acotada
+LOTE_PAGINAS = 50
+
+# Imagen en línea de pdf_utils.imagen_paleta_en_linea, al final del form
+# (antes solo va el preámbulo que ReportLab pone en todo form, sin dibujo)
+IMAGEN_PALETA = re.compile(
+    rb"BI /W (\d+) /H (\d+) /BPC 8 /CS \[/I /RGB (\d+) <([0-9a-f]*)>\] "
+    rb"/F \[/AHx /Fl\] ID ([0-9a-f]*)>\s*EI\s*\Z"
+)
+
+
+def _piezas(total, tareas, registro):
+    """
+    Orden del documento final: tramos de páginas del cuerpo ("cuerpo",
+    desde, hasta) (1-based, inclusivo) y PDFs reales ("documento", ruta) en
+    lugar de su marcador y los "huecos" que el plan reservó detrás.
+    """
+    piezas = []
+    inicio_tramo = 1
+    num_pdf = 1
+
+    while num_pdf <= total:
+        ruta_pdf_real = tareas.get(num_pdf)
+
+        if ruta_pdf_real is None:
+            num_pdf += 1
+            continue
+
+        if not existe_archivo(ruta_pdf_real):
+            print(f"⚠️ Archivo no encontrado: {ruta_pdf_real}. Manteniendo marcador.")
+            num_pdf += 1
+            continue
+
+        print(f"-> Insertando: {nombre_base(ruta_pdf_real)} (Sustituye pág {num_pdf})")
+
+        # Páginas normales del cuerpo antes del marcador
+        if num_pdf > inicio_tramo:
+            piezas.append(("cuerpo", inicio_tramo, num_pdf - 1))
+
+        # Todas las páginas del PDF real en lugar del marcador y sus huecos
+        piezas.append(("documento", ruta_pdf_real))
+        num_pdf += registro.paginas(ruta_pdf_real)
+        inicio_tramo = num_pdf
+
+    if inicio_tramo <= total:
+        piezas.append(("cuerpo", inicio_tramo, total))
+
+    return piezas
+
+
+def paletas_a_imagenes(doc):
+    """
+    Cambia cada form que solo lleva una imagen con paleta en línea (ver
+    pdf_utils.dibujar_imagen) por un /Image indexado con los mismos datos en
+    binario (Flate), sin volver a codificar nada. El form y la imagen se
+    pintan en el mismo cuadro unitario, así que las páginas que lo usan no
+    cambian. Regresa cuántas imágenes cambió.
+    """
+    cambiadas = 0
+    for xref in range(1, doc.xref_length()):
+        if doc.xref_get_key(xref, "Subtype") != ("name", "/Form"):
+            continue
+        if doc.xref_get_key(xref, "BBox") != ("array", "[0 0 1 1]"):
+            continue
+        encontrada = IMAGEN_PALETA.search(doc.xref_stream(xref))
+        if not encontrada:
+            continue
+
+        ancho, alto, maximo, paleta, datos = encontrada.groups()
+        doc.update_object(xref, (
+            f"<</Type/XObject/Subtype/Image/Width {int(ancho)}/Height {int(alto)}"
+            f"/BitsPerComponent 8/ColorSpace[/Indexed/DeviceRGB {int(maximo)}"
+            f"<{paleta.decode('ascii')}>]>>"
+        ))
+        doc.update_stream(xref, bytes.fromhex(datos.decode("ascii")), compress=False)
+        # update_stream sin comprimir quita /Filter; los datos ya van en Flate
+        doc.xref_set_key(xref, "Filter", "/FlateDecode")
+        cambiadas += 1
+    return cambiadas
+
+
+def _links_uri(pagina):
+    """
+    Links URI de una página del cuerpo como (rect, uri). MuPDF toma los URI
+    relativos ("anexos/...") por archivos y al injertar la página los
+    reescribe como acciones GoToR/Launch, que varios visores bloquean.
+    """
+    doc = pagina.parent
+    links = []
+    for link in pagina.get_links():
+        if doc.xref_get_key(link["xref"], "A/S") == ("name", "/URI"):
+            tipo, uri = doc.xref_get_key(link["xref"], "A/URI")
+            if tipo == "string":
+                links.append((link["from"], uri))
+    return links
+
+
+def _restaurar_links(salida, base, cuerpo, desde, hasta):
+    """
+    Vuelve a dejar como /URI los links de las páginas desde..hasta (1-based)
+    del cuerpo, ya injertadas en `salida` a partir del índice `base`.
+    """
+    for pagina in range(desde, hasta + 1):
+        originales = _links_uri(cuerpo[pagina - 1])
+        if not originales:
+            continue
+        destino = salida[base + pagina - desde]
+        for link in destino.get_links():
+            for rect, uri in originales:
+                if link["from"] == rect:
+                    salida.xref_set_key(
+                        link["xref"], "A", f"<</S/URI/URI{fitz.get_pdf_str(uri)}>>"
+                    )
+                    break
+
+
+def ensamblar_documento(cuerpo_path, insert_tasks, registro, salida_path, superposiciones=(),
+                        lote_paginas=None, memoria_lote_mb=None):
+    """
+    Arma el PDF final a partir del cuerpo generado por ReportLab.
+
+    insert_tasks: lista de (página, ruta_pdf). La página marcador y los
+    "huecos" que el plan reservó detrás de ella se sustituyen por todas las
+    páginas del PDF real. Las páginas se injertan por tramos con insert_pdf
+    (copia nativa de objetos, sin volver a parsear en Python).
+
+    superposiciones: lista de (página, ruta_pdf) con el contenido de las
+    secciones dibujadas aparte; cada página del PDF se pone encima de la
+    página correspondiente del cuerpo a partir de `página`.
+
+    Con `lote_paginas` el resultado se escribe por lotes (ver
+    _ensamblar_por_lotes) para no tener todo el documento en memoria.
+
+    Regresa el número de páginas del documento final.
+    """
+    tareas = dict(insert_tasks)
+
+    if lote_paginas:
+        return _ensamblar_por_lotes(
+            cuerpo_path, tareas, registro, salida_path, superposiciones,
+            lote_paginas, memoria_lote_mb,
+        )
+
+    salida = fitz.open()
+
+    with fitz.open(cuerpo_path) as cuerpo:
+        paletas_a_imagenes(cuerpo)
+        for pagina, ruta_seccion in superposiciones:
+            with fitz.open(ruta_seccion) as seccion:
+                paletas_a_imagenes(seccion)
+                for k in range(seccion.page_count):
+                    destino = cuerpo[pagina - 1 + k]
+                    destino.show_pdf_page(destino.rect, seccion, k)
+
+        for pieza in _piezas(cuerpo.page_count, tareas, registro):
+            if pieza[0] == "documento":
+                salida.insert_pdf(registro.documento(pieza[1]))
+            else:
+                base = salida.page_count
+                salida.insert_pdf(cuerpo, from_page=pieza[1] - 1, to_page=pieza[2] - 1)
+                _restaurar_links(salida, base, cuerpo, pieza[1], pieza[2])
+
+        # Copiamos metadatos básicos
+        salida.set_metadata(cuerpo.metadata)
+
+    # garbage=4 une objetos repetidos comparando su contenido: las fotos que
+    # se repiten entre tramos dibujados en PDFs aparte quedan una sola vez
+    salida.save(salida_path, garbage=4, deflate=True)
+    paginas = salida.page_count
+    salida.close()
+    return paginas
+
+
+# ============================================================
+# MODO DE MEMORIA ACOTADA
+# ============================================================
+class _SalidaPorLotes:
+    """
+    PDF de salida que crece en disco: cada lote se agrega abriendo el
+    archivo, insertando sus páginas y guardando de forma incremental (solo
+    se escriben los objetos nuevos). Al cerrarlo se libera todo lo del lote.
+    """
+
+    def __init__(self, ruta, metadata):
+        self.ruta = ruta
+        self.metadata = metadata
+        self.creada = False
+        self.paginas = 0
+
+    def agregar(self, llenar):
+        salida = fitz.open(self.ruta) if self.creada else fitz.open()
+        try:
+            llenar(salida)
+            self.paginas = salida.page_count
+            if self.creada:
+                salida.save(self.ruta, incremental=True, encryption=fitz.PDF_ENCRYPT_KEEP)
+            else:
+                salida.set_metadata(self.metadata)
+                salida.save(self.ruta, garbage=1, deflate=True)
+                self.creada = True
+        finally:
+            salida.close()
+
+
+def _copiar_cuerpo(salida, cuerpo, desde, hasta, mapa):
+    base = salida.page_count
+    salida.insert_pdf(cuerpo, from_page=desde - 1, to_page=hasta - 1)
+    _restaurar_links(salida, base, cuerpo, desde, hasta)
+
+    abiertos = {}
+    try:
+        for pagina in range(desde, hasta + 1):
+            if pagina not in mapa:
+                continue
+            ruta, k = mapa[pagina]
+            if ruta not in abiertos:
+                abiertos[ruta] = fitz.open(ruta)
+                paletas_a_imagenes(abiertos[ruta])
+            destino = salida[base + pagina - desde]
+            destino.show_pdf_page(destino.rect, abiertos[ruta], k)
+    finally:
+        for doc in abiertos.values():
+            doc.close()
+
+
+def _ajustar_lote(lote, memoria_lote_mb, avisado):
+    """
+    Reduce el lote a la mitad si la memoria del proceso se acerca a
+    `memoria_lote_mb`. Es solo una referencia para el tamaño del lote: no
+    limita la memoria de las demás etapas.
+    """
+    if not memoria_lote_mb:
+        return lote
+    actual = memoria_actual_mb()
+    if actual is None or actual < memoria_lote_mb * 0.8:
+        return lote
+
+    gc.collect()
+    if actual > memoria_lote_mb and not avisado:
+        print(f"⚠️ Memoria en {actual:.0f} MB al ensamblar, por encima de los {memoria_lote_mb} MB indicados")
+        avisado.append(True)
+    return max(1, lote // 2)
+
+
+def _ensamblar_por_lotes(cuerpo_path, tareas, registro, salida_path, superposiciones,
+                         lote_paginas, memoria_lote_mb):
+    """
+    Igual que ensamblar_documento, pero sin tener nunca el documento
+    completo en memoria: las páginas del cuerpo (con sus fotos superpuestas)
+    se copian en lotes de `lote_paginas` y cada lote se agrega al archivo de
+    salida con un guardado incremental. Si se pasa `memoria_lote_mb` el
+    lote se achica cuando la memoria del proceso se acerca a ese valor.
+
+    No se unen fotos repetidas entre lotes (garbage=4 necesitaría el
+    documento completo), así que el resultado puede pesar un poco más.
+    """
+    # Página del cuerpo -> (PDF del tramo, página dentro de él)
+    mapa = {}
+    for pagina, ruta in superposiciones:
+        with fitz.open(ruta) as seccion:
+            for k in range(seccion.page_count):
+                mapa[pagina + k] = (ruta, k)
+
+    avisado = []
+    lote = lote_paginas
+
+    with fitz.open(cuerpo_path) as cuerpo:
+        paletas_a_imagenes(cuerpo)
+        salida = _SalidaPorLotes(salida_path, cuerpo.metadata)
+
+        for pieza in _piezas(cuerpo.page_count, tareas, registro):
+            if pieza[0] == "documento":
+                doc = registro.documento(pieza[1])
+                salida.agregar(lambda s: s.insert_pdf(doc))
+                continue
+
+            _, desde, hasta = pieza
+            while desde <= hasta:
+                fin = min(hasta, desde + lote - 1)
+                salida.agregar(lambda s: _copiar_cuerpo(s, cuerpo, desde, fin, mapa))
+                desde = fin + 1
+                lote = _ajustar_lote(lote, memoria_lote_mb, avisado)
+
+    return salida.paginas
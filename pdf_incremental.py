@@ -0,0 +1,327 @@
+import os
+import json
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+
+from reportlab.pdfgen import canvas
+from reportlab.lib.pagesizes import A4
+
+import image_cache
+from image_cache import CacheImagenes, cache_configurada
+from instrumentacion import Instrumentacion
+from pdf_utils import dibujar_celdas, streams_binarios
+from file_engine import (
+    huella_archivo,
+    nombre_base,
+)
+
+# Carpeta y tamaño por defecto de la caché de secciones ya dibujadas
+CACHE_SECCIONES_DIR = os.path.join(os.path.expanduser("~"), ".mteasypdf", "cache_secciones")
+TAMANO_MAXIMO_MB = 1024
+
+# Subir este número cuando cambie cómo se dibuja el contenido de una sección
+VERSION_SECCIONES = 4
+
+# Campos de project_data que se guardan en el manifiesto
+CAMPOS_PROYECTO = [
+    "titulo",
+    "info_extra",
+    "introduccion",
+    "imagen_portada",
+    "logo_sup_izq",
+    "logo_sup_der",
+    "logo_inf_izq",
+    "logo_inf_der",
+    "dpi_imagenes",
+    "calidad_imagenes",
+]
+
+cache_secciones = CacheImagenes(CACHE_SECCIONES_DIR, TAMANO_MAXIMO_MB, extension=".pdf")
+
+
+def configurar_cache_secciones(carpeta=None, tamano_maximo_mb=None):
+    global cache_secciones
+    cache_secciones = cache_configurada(
+        cache_secciones,
+        carpeta or CACHE_SECCIONES_DIR,
+        tamano_maximo_mb if tamano_maximo_mb is not None else TAMANO_MAXIMO_MB,
+    )
+    return cache_secciones
+
+
+# ============================================================
+# CLAVES DE SECCIÓN
+# ============================================================
+def _op_sin_pagina(op):
+    # Lo que determina cómo se ve la sección, sin el número de página
+    # (cambia si una sección anterior crece) ni la ruta del ZIP
+    datos = {k: v for k, v in op.items() if k != "pagina"}
+    if op["tipo"] == "imagenes":
+        datos["celdas"] = [
+            {
+                **{k: v for k, v in celda.items() if k != "path"},
+                "nombre": nombre_base(celda["path"]),
+                "huella": huella_archivo(celda["path"]),
+            }
+            for celda in op["celdas"]
+        ]
+    return datos
+
+
+def clave_tramo(plan, tramo, dpi, calidad):
+    ops = [_op_sin_pagina(op) for op in plan.ops[tramo["desde"]:tramo["hasta"]]]
+    contenido = json.dumps(
+        {"version": VERSION_SECCIONES, "dpi": dpi, "calidad": calidad, "ops": ops},
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(contenido.encode("utf-8")).hexdigest()
+
+
+# ============================================================
+# RENDER INCREMENTAL
+# ============================================================
+def _dibujar_tramo_en_worker(ruta, ops, dpi, calidad, carpeta_cache, tamano_cache_mb):
+    """
+    Dibuja en un proceso aparte las fotos de un tramo (sin textos). Regresa
+    el efecto en la caché y las mediciones por imagen para sumarlos en el
+    proceso principal.
+    """
+    image_cache.configurar_cache(carpeta_cache, tamano_cache_mb)
+    cache = image_cache.cache_imagenes
+    hits, misses = cache.hits, cache.misses
+    instr = Instrumentacion()
+
+    with streams_binarios():
+        c = canvas.Canvas(ruta, pagesize=A4, pageCompression=1)
+        # Un salto inicial es el que abre el tramo (ya es la página 1 del PDF)
+        if ops and ops[0]["tipo"] == "salto":
+            ops = ops[1:]
+        for op in ops:
+            if op["tipo"] == "salto":
+                c.showPage()
+            elif op["tipo"] == "imagenes":
+                dibujar_celdas(
+                    c, op["celdas"], dpi=dpi, calidad=calidad, textos=False, instrumentacion=instr
+                )
+        c.showPage()
+        c.save()
+    return cache.hits - hits, cache.misses - misses, instr.contadores, instr.mediciones
+
+
+class RenderIncremental:
+    """
+    Reutiliza las fotos ya dibujadas de los tramos de mantenimiento (una
+    categoría, que siempre termina en salto de página) que no cambiaron
+    desde la corrida anterior.
+
+    Las fotos de cada tramo (fondo de celda e imagen) se dibujan en un PDF
+    aparte que se guarda en la caché de secciones; el cuerpo lleva todo lo
+    demás (encabezado, número de página, títulos y nombres) y, al ensamblar,
+    cada página del PDF aparte se pone encima de la suya. Así un tramo se
+    reutiliza aunque sus números de página se hayan movido, y los PDF
+    aparte no llevan fuentes que se repitan en el resultado.
+
+    Con reutilizar=False se dibujan igual por tramos (lo usa el modo de
+    memoria acotada) pero sin leer ni guardar la caché de secciones.
+    """
+
+    def __init__(self, carpeta_trabajo, cache=None, reutilizar=True):
+        self.carpeta = carpeta_trabajo
+        self.cache = cache or cache_secciones
+        self.reutilizar = reutilizar
+        self.tramos = {}
+        # (primera página en el cuerpo, ruta del PDF con las fotos del tramo)
+        self.superposiciones = []
+        self.reutilizadas = []
+        self.regeneradas = []
+        self._pool = None
+
+    def preparar(self, plan, dpi, calidad):
+        """Calcula la clave de cada tramo y trae de la caché los que ya existen."""
+        for tramo in plan.tramos:
+            clave = clave_tramo(plan, tramo, dpi, calidad)
+            ruta = os.path.join(self.carpeta, f"tramo_{tramo['desde']}.pdf")
+            datos = self.cache.obtener(clave) if self.reutilizar else None
+            if datos is not None:
+                with open(ruta, "wb") as f:
+                    f.write(datos)
+            self.tramos[tramo["desde"]] = dict(
+                tramo, clave=clave, ruta=ruta, reutilizar=datos is not None
+            )
+
+    @property
+    def en_paralelo(self):
+        return self._pool is not None
+
+    def lanzar(self, plan, dpi, calidad, workers):
+        """
+        Manda a dibujar en procesos aparte los tramos que no están en caché.
+        Como sus PDFs no llevan números de página, no hace falta saber dónde
+        caen: el cuerpo se sigue dibujando aquí mientras tanto.
+        """
+        pendientes = [t for t in self.tramos.values() if not t["reutilizar"]]
+        if workers <= 1 or not pendientes:
+            return
+
+        cache = image_cache.cache_imagenes
+        self._pool = ProcessPoolExecutor(max_workers=min(workers, len(pendientes)))
+        for tramo in pendientes:
+            tramo["futuro"] = self._pool.submit(
+                _dibujar_tramo_en_worker,
+                tramo["ruta"],
+                plan.ops[tramo["desde"]:tramo["hasta"]],
+                dpi,
+                calidad,
+                cache.carpeta,
+                cache.tamano_maximo / (1024 * 1024),
+            )
+
+    def esperar(self, instrumentacion=None):
+        """
+        Espera los tramos dibujados en paralelo y los guarda en la caché.
+        Sus mediciones por imagen se suman a `instrumentacion`.
+        """
+        if self._pool is None:
+            return
+        try:
+            cache = image_cache.cache_imagenes
+            for tramo in self.tramos.values():
+                if "futuro" not in tramo:
+                    continue
+                hits, misses, contadores, mediciones = tramo.pop("futuro").result()
+                cache.hits += hits
+                cache.misses += misses
+                if instrumentacion:
+                    instrumentacion.sumar(contadores, mediciones)
+                # Los avisos de cada foto salen en la consola del proceso aparte
+                fallidas = contadores.get("imagenes_fallidas", 0)
+                if fallidas:
+                    print(f"⚠️ {fallidas} imagen(es) no se pudieron cargar en: {tramo['titulo']}")
+                self._guardar(tramo)
+        finally:
+            self.cancelar()
+
+    def cancelar(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+
+    def ops_omitidas(self):
+        """Índices de operaciones cuyas fotos no hay que preparar aquí."""
+        omitidas = set()
+        for tramo in self.tramos.values():
+            if tramo["reutilizar"] or "futuro" in tramo:
+                omitidas.update(range(tramo["desde"], tramo["hasta"]))
+        return omitidas
+
+    def abrir(self, tramo, pagina_inicio):
+        """
+        Regresa el canvas donde dibujar las fotos del tramo (None si se
+        reutiliza o se está dibujando en otro proceso).
+        """
+        self.superposiciones.append((pagina_inicio, tramo["ruta"]))
+        if tramo["reutilizar"]:
+            self.reutilizadas.append(tramo["titulo"])
+            return None
+        self.regeneradas.append(tramo["titulo"])
+        if "futuro" in tramo:
+            return None
+        return canvas.Canvas(tramo["ruta"], pagesize=A4, pageCompression=1)
+
+    def cerrar(self, tramo, c_tramo):
+        if c_tramo is None:
+            return
+        c_tramo.showPage()
+        c_tramo.save()
+        self._guardar(tramo)
+
+    def _guardar(self, tramo):
+        if not self.reutilizar:
+            return
+        with open(tramo["ruta"], "rb") as f:
+            self.cache.guardar(tramo["clave"], f.read())
+
+
+# ============================================================
+# MANIFIESTO
+# ============================================================
+def ruta_manifiesto(zip_entrega):
+    """El manifiesto de la corrida va junto al ZIP de entrega."""
+    return os.path.splitext(zip_entrega)[0] + "_manifiesto.json"
+
+
+def construir_manifiesto(project_data, mantenimiento_tree, raiz, incremental=None):
+    """
+    Huellas de cada archivo de mantenimiento, de cada nodo del árbol
+    (sección / subsección / grupo / categoría) y los campos del proyecto.
+    """
+    def relativa(ruta):
+        return ruta[len(raiz):].replace("\\", "/").lstrip("/")
+
+    archivos = {}
+    nodos = {}
+
+    def huella_nodo(nombre, hijos):
+        h = hashlib.sha256()
+        for hijo in hijos:
+            h.update(hijo.encode("utf-8") + b"\0")
+        nodos[nombre] = h.hexdigest()
+        return nodos[nombre]
+
+    secciones = []
+    for seccion, subsecciones in mantenimiento_tree.items():
+        subs = []
+        for subseccion, grupos in subsecciones.items():
+            grs = []
+            for grupo, categorias in grupos.items():
+                cats = []
+                for categoria, imagenes in categorias.items():
+                    huellas = []
+                    for img in imagenes:
+                        archivos[relativa(img)] = huella_archivo(img)
+                        huellas.append(f"{relativa(img)}={archivos[relativa(img)]}")
+                    nombre = "/".join(n for n in [seccion, subseccion, grupo, categoria] if n)
+                    cats.append(huella_nodo(nombre, huellas))
+                nombre = "/".join(n for n in [seccion, subseccion, grupo] if n)
+                grs.append(huella_nodo(nombre, cats))
+            nombre = "/".join(n for n in [seccion, subseccion] if n)
+            subs.append(huella_nodo(nombre, grs))
+        secciones.append(huella_nodo(seccion, subs))
+
+    return {
+        "version": VERSION_SECCIONES,
+        "proyecto": {campo: project_data.get(campo) for campo in CAMPOS_PROYECTO},
+        "archivos": archivos,
+        "nodos": nodos,
+        "tramos": [
+            {"seccion": t["titulo"], "clave": t["clave"], "reutilizado": t["reutilizar"]}
+            for t in (incremental.tramos.values() if incremental else [])
+        ],
+    }
+
+
+def cargar_manifiesto(ruta):
+    try:
+        with open(ruta, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def guardar_manifiesto(ruta, manifiesto):
+    with open(ruta, "w", encoding="utf-8") as f:
+        json.dump(manifiesto, f, indent=2, ensure_ascii=False)
+    return ruta
+
+
+def comparar_manifiestos(anterior, nuevo):
+    """Regresa (campos del proyecto que cambiaron, nodos nuevos/cambiados/quitados)."""
+    campos = [
+        campo for campo in CAMPOS_PROYECTO
+        if anterior.get("proyecto", {}).get(campo) != nuevo["proyecto"].get(campo)
+    ]
+    nodos_previos = anterior.get("nodos", {})
+    cambiados = [n for n, h in nuevo["nodos"].items() if nodos_previos.get(n) != h]
+    quitados = [n for n in nodos_previos if n not in nuevo["nodos"]]
+    return campos, cambiados + quitados
@@ -1,6 +1,10 @@
+import io
 import os
+import re
+import zlib
+import hashlib
+from PIL import Image
 from reportlab.lib.pagesizes import A4
-from reportlab.lib.colors import black
 from reportlab.platypus import Paragraph
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.utils import ImageReader
@@ -9,11 +13,27 @@ from reportlab.pdfbase.ttfonts import TTFont
 
 from file_engine import (
     limpiar_nombre,
+    nombre_base,
 )
 
 PAGE_WIDTH, PAGE_HEIGHT = A4
 MARGIN = 40
 
+# Alturas que consumen los títulos (las comparte el planificador de páginas)
+ALTO_TITULO_SECCION = 40
+ALTO_SUBTITULO = 22
+
+LOGOS = ["logo_sup_izq", "logo_sup_der", "logo_inf_izq", "logo_inf_der"]
+DPI_LOGOS = 300
+
+# Cajas (puntos) en las que se dibujan la portada y los logos
+CAJA_PORTADA = (PAGE_WIDTH - 2 * MARGIN, 320)
+ALTO_LOGOS = 50
+CAJA_LOGOS = (PAGE_WIDTH, ALTO_LOGOS)
+
+# Logos y portada ya reducidos, cargados una sola vez por corrida
+_imagenes_cargadas = {}
+
 try:
     pdfmetrics.registerFont(TTFont('Arial', 'arial.ttf'))
     pdfmetrics.registerFont(TTFont('Arial-Bold', 'arialbd.ttf'))
@@ -34,6 +54,72 @@ def limpiar_texto_usuario(texto):
     texto = "".join(c for c in texto if c.isprintable())
     return texto.strip()
 
+def _reducir_imagen(path, caja, dpi=DPI_LOGOS):
+    # Bytes (PNG o JPEG) de la imagen reducida y su tamaño original
+    st = os.stat(path)
+    clave = (os.path.abspath(path), st.st_mtime, st.st_size, caja, dpi)
+
+    if clave not in _imagenes_cargadas:
+        with Image.open(path) as img:
+            tamano_original = img.size
+            img.thumbnail(
+                (int(caja[0] * dpi / 72), int(caja[1] * dpi / 72)),
+                Image.LANCZOS,
+            )
+            buf = io.BytesIO()
+            if img.mode in ("RGBA", "LA", "P"):
+                # Conservamos la transparencia de los logos
+                img.save(buf, format="PNG", optimize=True)
+            else:
+                img.convert("RGB").save(buf, format="JPEG", quality=90)
+        _imagenes_cargadas[clave] = (buf.getvalue(), tamano_original)
+    return _imagenes_cargadas[clave]
+
+
+def cargar_imagen_reducida(path, caja, dpi=DPI_LOGOS):
+    """
+    Regresa (ImageReader, (ancho_original, alto_original)) de una imagen
+    reducida para caber en `caja` (puntos) a `dpi`. El archivo se abre y se
+    reduce solo la primera vez; después se reutilizan los bytes en memoria.
+    """
+    datos, tamano_original = _reducir_imagen(path, caja, dpi)
+    return ImageReader(io.BytesIO(datos)), tamano_original
+
+
+def peso_imagen_reducida(path, caja, dpi=DPI_LOGOS):
+    """
+    Bytes que ocupa en el PDF la imagen de cargar_imagen_reducida. Un JPEG
+    se incrusta tal cual; de un PNG ReportLab guarda los píxeles RGB
+    comprimidos con Flate y, si hay transparencia, el canal alfa aparte.
+    """
+    datos, _ = _reducir_imagen(path, caja, dpi)
+    if datos[:2] == b"\xff\xd8":
+        return len(datos)
+
+    with Image.open(io.BytesIO(datos)) as img:
+        if img.mode == "P":
+            img = img.convert("RGBA")
+        total = len(zlib.compress(img.convert("RGB").tobytes()))
+        if img.mode in ("RGBA", "LA"):
+            total += len(zlib.compress(img.getchannel("A").tobytes()))
+    return total
+
+
+def peso_imagenes_proyecto(data):
+    """
+    Bytes de la portada y los logos tal como quedan en el PDF: reducidos a
+    su caja y cada logo una sola vez (ver registrar_logos).
+    """
+    total = 0
+    imagen = data.get("imagen_portada")
+    if imagen and os.path.exists(imagen):
+        total += peso_imagen_reducida(imagen, CAJA_PORTADA)
+    for path in {data.get(key) for key in LOGOS}:
+        if path and os.path.exists(path):
+            total += peso_imagen_reducida(path, CAJA_LOGOS)
+    return total
+
+
 def draw_cover(canvas, data, project_data):
     """
     Dibuja la portada del documento.
@@ -45,8 +131,9 @@ def draw_cover(canvas, data, project_data):
     # Imagen central
     imagen = data.get("imagen_portada")
     if imagen and os.path.exists(imagen):
+        img, _ = cargar_imagen_reducida(imagen, CAJA_PORTADA)
         canvas.drawImage(
-            imagen,
+            img,
             MARGIN,
             PAGE_HEIGHT / 2 - 160,
             width=PAGE_WIDTH - 2 * MARGIN,
@@ -75,34 +162,51 @@ def draw_cover(canvas, data, project_data):
     # Finaliza la página de portada e incrementa el contador del canvas a 2
     canvas.showPage()
 
-def draw_header_footer(canvas, page_num, data):
-    actual_p = canvas.getPageNumber()
-    max_height = 50  # El alto máximo que deseas
+def registrar_logos(canvas, data):
+    """
+    Dibuja los cuatro logos una sola vez dentro de un Form XObject del
+    documento y regresa su nombre. Cada página solo hace referencia a él,
+    así el PDF guarda cada logo una vez y no se relee ningún archivo.
+    """
+    rutas = "|".join(str(data.get(key) or "") for key in LOGOS)
+    nombre = "Logos" + hashlib.md5(rutas.encode("utf-8")).hexdigest()[:12]
+    if canvas.hasForm(nombre):
+        return nombre
+
+    max_height = ALTO_LOGOS  # El alto máximo que deseas
     padding = 20
 
-    for key in ["logo_sup_izq", "logo_sup_der", "logo_inf_izq", "logo_inf_der"]:
+    canvas.beginForm(nombre)
+    for key in LOGOS:
         path = data.get(key)
         if path and os.path.exists(path):
-            # 1. Leer la imagen y obtener dimensiones originales
-            img = ImageReader(path)
-            orig_w, orig_h = img.getSize()
-            
+            # 1. Imagen reducida y dimensiones originales
+            img, (orig_w, orig_h) = cargar_imagen_reducida(path, CAJA_LOGOS)
+
             # 2. Calcular el ancho proporcional basado en el alto deseado (50)
             aspect_ratio = orig_w / orig_h
             calc_width = max_height * aspect_ratio
-            
+
             # 3. Posicionamiento dinámico basado en el nuevo ancho
-            if "sup_izq" in key: 
+            if "sup_izq" in key:
                 x, y = padding, PAGE_HEIGHT - max_height - padding
-            elif "sup_der" in key: 
+            elif "sup_der" in key:
                 x, y = PAGE_WIDTH - calc_width - padding, PAGE_HEIGHT - max_height - padding
-            elif "inf_izq" in key: 
+            elif "inf_izq" in key:
                 x, y = padding, padding
             else: # inf_der
                 x, y = PAGE_WIDTH - calc_width - padding, padding
-            
+
             # 4. Dibujar con las dimensiones calculadas
             canvas.drawImage(img, x, y, width=calc_width, height=max_height, mask="auto")
+    canvas.endForm()
+
+    return nombre
+
+def draw_header_footer(canvas, page_num, data):
+    actual_p = canvas.getPageNumber()
+
+    canvas.doForm(registrar_logos(canvas, data))
 
     # Número de página
     if actual_p > 1: 
@@ -116,32 +220,51 @@ def draw_section_title(canvas, title, y=None):
     canvas.setFont(FUENTE_NEGRITA, 18)
     canvas.drawString(MARGIN, y, clean_title)
     canvas.line(MARGIN, y - 8, PAGE_WIDTH - MARGIN, y - 8)
-    return y - 40
+    return y - ALTO_TITULO_SECCION
 
 def draw_subsection_title(canvas, text, y):
     canvas.setFont(FUENTE_NEGRITA, 14)
     clean_text = text.lstrip("0123456789.-_ ").strip()
     canvas.drawString(MARGIN, y, clean_text)
-    return y - 22
+    return y - ALTO_SUBTITULO
 
-def nueva_pagina_con_titulo(canvas, project_data, titulo):
+# Métricas del índice (las comparte medir_paginas_indice para medirlo sin dibujar)
+INDICE_Y_INICIO = PAGE_HEIGHT - 120
+INDICE_ALTO_TITULO = 40
+INDICE_Y_MINIMO = 100
 
-    canvas.showPage()
-    # Obtenemos el número real del sistema
-    actual_p = canvas.getPageNumber()
-    
-    draw_header_footer(canvas, actual_p, project_data)
 
-    cursor_y = PAGE_HEIGHT - 100
-    cursor_y = draw_section_title(canvas, titulo, cursor_y)
-    return cursor_y # Solo devuelve el cursor
+def metricas_nivel_indice(level):
+    """(tamaño de fuente, interlineado) de una entrada del índice."""
+    if level == 1: return 14, 24 # Un poco más de aire
+    elif level == 2: return 13, 20
+    else: return 12, 18
+
+
+def medir_paginas_indice(index_items):
+    """
+    Páginas que ocupará draw_index con estas entradas, con las mismas
+    reglas de salto (interlineado por nivel y corte en cursor_y < 100).
+    Los títulos no se parten en varias líneas, así que no hace falta medir
+    texto.
+    """
+    paginas = 1
+    cursor_y = INDICE_Y_INICIO - INDICE_ALTO_TITULO
+    for item in index_items:
+        _, line_gap = metricas_nivel_indice(item["level"])
+        if cursor_y < INDICE_Y_MINIMO:
+            paginas += 1
+            cursor_y = INDICE_Y_INICIO - INDICE_ALTO_TITULO
+        cursor_y -= line_gap
+    return paginas
+
 
 def draw_index(canvas, index_items, project_data):
-    cursor_y = PAGE_HEIGHT - 120
+    cursor_y = INDICE_Y_INICIO
     canvas.setFont(FUENTE_NEGRITA, 20)
     canvas.drawString(MARGIN, cursor_y, "Índice")
     canvas.line(MARGIN, cursor_y - 8, PAGE_WIDTH - MARGIN, cursor_y - 8)
-    cursor_y -= 40
+    cursor_y -= INDICE_ALTO_TITULO
 
     def clean_title_idx(text):
         return text.lstrip("0123456789.- ").strip()
@@ -151,18 +274,16 @@ def draw_index(canvas, index_items, project_data):
 
     for item in index_items:
         level = item["level"]
-        if level == 1: font_size, line_gap = 14, 24 # Un poco más de aire
-        elif level == 2: font_size, line_gap = 13, 20
-        else: font_size, line_gap = 12, 18
+        font_size, line_gap = metricas_nivel_indice(level)
 
-        if cursor_y < 100:
+        if cursor_y < INDICE_Y_MINIMO:
             canvas.showPage()
             # IMPORTANTE: draw_header_footer ya usa canvas.getPageNumber() internamente
             draw_header_footer(canvas, None, project_data) 
-            cursor_y = PAGE_HEIGHT - 120 # Reset de altura tras encabezado
+            cursor_y = INDICE_Y_INICIO # Reset de altura tras encabezado
             canvas.setFont(FUENTE_NEGRITA, 20)
             canvas.drawString(MARGIN, cursor_y, "Índice") # Opcional: subtítulo
-            cursor_y -= 40
+            cursor_y -= INDICE_ALTO_TITULO
 
         canvas.setFont(FUENTE_TEXTO, font_size)
         indent = (level - 1) * INDENT_STEP
@@ -237,83 +358,50 @@ def draw_introduccion(canvas, texto, project_data, start_y=None):
     return cursor_y - h - 30
 
 
-def render_documentacion_links(canvas, cursor_y, pdf_tree, project_data, index=None):
-    canvas.showPage()
-    draw_header_footer(canvas, canvas.getPageNumber(), project_data)
-    
-    # 1. Espacio superior compacto
-    cursor_y = PAGE_HEIGHT - 100 
-    cursor_y = draw_section_title(canvas, "Documentación Técnica", cursor_y)
-    
-    if index:
-        index.add("Documentación Técnica", canvas.getPageNumber(), level=1)
-    
-    # Pegamos el primer encabezado al título principal
-    cursor_y -= 5 
-
-    for seccion, subsecciones in pdf_tree.items():
-        # Verificación de contenido
-        tiene_pdfs = any(
-            pdf_list 
-            for sub in subsecciones.values() 
-            for grupo in sub.values() 
-            for pdf_list in grupo.values() 
-            if pdf_list
-        )
-        
-        if not tiene_pdfs:
-            continue
-        
-        # 2. Limpieza de nombre de sección (quitando números como "04 ")
-        seccion_aux = limpiar_nombre(seccion)
-        # Si limpiar_nombre no quita los números, lo hacemos manualmente:
-        import re
-        seccion_limpia = re.sub(r'^\d+\s*', '', seccion_aux).strip()
-
-        canvas.setFont(FUENTE_NEGRITA, 12)
-        canvas.setFillColorRGB(0.2, 0.4, 0.6)
-        canvas.drawString(MARGIN, cursor_y, f"Archivos de: {seccion_limpia}")
-        canvas.setFillColor("black")
-        
-        # 3. Más espacio entre el encabezado azul y la lista
-        cursor_y -= 25 
-
-        for subseccion, grupos in subsecciones.items():
-            for grupo, categorias in grupos.items():
-                for categoria, pdfs in categorias.items():
-                    for pdf_path in pdfs:
-                        # Control de salto de página
-                        if cursor_y < 120:
-                            canvas.showPage()
-                            draw_header_footer(canvas, canvas.getPageNumber(), project_data)
-                            cursor_y = PAGE_HEIGHT - 100
-                        
-                        # DEFINICIÓN CLAVE
-                        nombre_archivo = os.path.basename(pdf_path)
-                        
-                        # Limpieza de textos de origen
-                        sub_l = re.sub(r'^\d+\s*', '', limpiar_nombre(subseccion)).strip()
-                        gru_l = re.sub(r'^\d+\s*', '', limpiar_nombre(grupo)).strip()
-                        origen = f"{sub_l} > {gru_l}" if grupo else sub_l
-                        
-                        # Dibujo del elemento
-                        canvas.setFont(FUENTE_TEXTO, 11)
-                        canvas.setFillColor("blue")
-                        canvas.drawString(MARGIN + 20, cursor_y, f"• {nombre_archivo}")
-                        
-                        canvas.setFont("Helvetica-Oblique", 8)
-                        canvas.setFillColorRGB(0.5, 0.5, 0.5)
-                        canvas.drawRightString(PAGE_WIDTH - MARGIN, cursor_y, origen)
-                        
-                        # Link (nombre_archivo ya está definido arriba)
-                        canvas.linkURL(f"anexos/{nombre_archivo}", 
-                                       (MARGIN, cursor_y - 2, PAGE_WIDTH - MARGIN, cursor_y + 12))
-                        
-                        canvas.setFillColor("black")
-                        # 4. Espaciado entre links aumentado
-                        cursor_y -= 22 
-        
-        # Espacio tras terminar una sección completa
-        cursor_y -= 10
-        
-    return cursor_y
\ No newline at end of file
+def limpiar_prefijo(nombre):
+    # Quita la numeración inicial ("04 ") que limpiar_nombre no elimina
+    return re.sub(r'^\d+\s*', '', limpiar_nombre(nombre)).strip()
+
+
+def draw_marcador_documento(canvas, pdf):
+    # Página marcador que después se sustituye por el PDF real
+    canvas.setFont(FUENTE_NEGRITA, 14)
+    canvas.drawString(MARGIN, PAGE_HEIGHT - 120, f"Documento: {nombre_base(pdf)}")
+
+
+def draw_encabezado_documentacion(canvas, seccion_limpia, y):
+    canvas.setFont(FUENTE_NEGRITA, 12)
+    canvas.setFillColorRGB(0.2, 0.4, 0.6)
+    canvas.drawString(MARGIN, y, f"Archivos de: {seccion_limpia}")
+    canvas.setFillColor("black")
+
+
+def draw_link_documentacion(canvas, pdf_path, origen, y, destino=None):
+    # destino: ruta del PDF dentro del ZIP de entrega (ver nombres_entrega)
+    nombre_archivo = nombre_base(pdf_path)
+
+    # Dibujo del elemento
+    canvas.setFont(FUENTE_TEXTO, 11)
+    canvas.setFillColor("blue")
+    canvas.drawString(MARGIN + 20, y, f"• {nombre_archivo}")
+
+    canvas.setFont("Helvetica-Oblique", 8)
+    canvas.setFillColorRGB(0.5, 0.5, 0.5)
+    canvas.drawRightString(PAGE_WIDTH - MARGIN, y, origen)
+
+    canvas.linkURL(destino or f"anexos/{nombre_archivo}",
+                   (MARGIN, y - 2, PAGE_WIDTH - MARGIN, y + 12))
+
+    canvas.setFillColor("black")
+
+
+def draw_link_anexo(canvas, pdf, y, destino=None):
+    nombre = nombre_base(pdf)
+    canvas.setFont(FUENTE_TEXTO, 12)
+    canvas.setFillColor("blue")
+    canvas.drawString(MARGIN + 20, y, f"• {nombre}")
+
+    # El link es relativo a la carpeta donde estará el PDF final
+    canvas.linkURL(
+        destino or f"anexos/{nombre}", (MARGIN + 20, y, MARGIN + 350, y + 12)
+    )
@@ -0,0 +1,711 @@
+import os
+
+from reportlab.lib.pagesizes import A4
+
+from pdf_utils import (
+    DPI_IMAGENES,
+    CALIDAD_IMAGENES,
+    calcular_celdas,
+    dibujar_celdas,
+    parametros_celda,
+    nombre_imagen,
+    prepare_image_for_pdf,
+)
+from image_prefetch import PrefetchImagenes, preparar_en_cache
+from file_engine import (
+    existe_archivo,
+)
+
+from pdf_layout import (
+    ALTO_TITULO_SECCION,
+    ALTO_SUBTITULO,
+    draw_cover,
+    draw_header_footer,
+    draw_section_title,
+    draw_subsection_title,
+    draw_index,
+    medir_paginas_indice,
+    draw_introduccion,
+    draw_marcador_documento,
+    draw_encabezado_documentacion,
+    draw_link_documentacion,
+    draw_link_anexo,
+    limpiar_prefijo,
+    peso_imagenes_proyecto,
+)
+
+PAGE_WIDTH, PAGE_HEIGHT = A4
+
+# Páginas máximas de un tramo: cada tramo se dibuja en su propio PDF, así
+# ninguno retiene en memoria más que este número de páginas con fotos
+PAGINAS_POR_TRAMO = 20
+
+# Vueltas máximas para que las páginas reservadas al índice cuadren
+MAX_VUELTAS_INDICE = 5
+
+# Peso objetivo: lo que no son fotos se estima con un fijo (fuentes
+# incrustadas, catálogo, tabla xref) más un tanto por página (texto,
+# encabezado, referencias), y de lo que queda para fotos solo se reparte
+# MARGEN_PESO por si la estimación se queda corta. Medido en un reporte de
+# 160 páginas: ~1.5 KB por página fuera de las fotos
+BYTES_FIJOS_PDF = 16 * 1024
+BYTES_POR_PAGINA = 1536
+MARGEN_PESO = 0.95
+PRESUPUESTO_MINIMO = 4 * 1024
+
+
+# ============================================================
+# PLAN DE PAGINACIÓN
+# ============================================================
+class PlanPaginas:
+    """
+    Lista ordenada de operaciones de dibujo. Cada operación guarda el número
+    de página en el que caerá, de modo que el índice se conoce sin dibujar
+    nada ni decodificar imágenes.
+    """
+
+    def __init__(self):
+        self.ops = []
+        self.pagina = 1
+        # Rangos de operaciones que empiezan en página nueva y no dependen de
+        # lo anterior (cada categoría de mantenimiento termina con un salto):
+        # sus imágenes se pueden reutilizar de una corrida a otra
+        self.tramos = []
+
+    def agregar(self, tipo, avanza=0, **datos):
+        # avanza = páginas que la operación consume internamente (portada, índice)
+        datos["tipo"] = tipo
+        datos["pagina"] = self.pagina
+        self.ops.append(datos)
+        self.pagina += avanza
+
+    def salto(self):
+        self.agregar("salto", avanza=1)
+
+    def nueva_pagina_con_titulo(self, titulo):
+        # Cada página nueva con título es un punto de corte válido: lo que
+        # sigue no depende de lo anterior, así que ahí se parten los tramos largos
+        tramo = self.tramos[-1] if self.tramos else None
+        if tramo and tramo["hasta"] is None and self.pagina - tramo["pagina"] >= PAGINAS_POR_TRAMO:
+            self.abrir_tramo(tramo["titulo"])
+        self.salto()
+        self.agregar("encabezado")
+        return self.titulo_seccion(titulo, PAGE_HEIGHT - 100)
+
+    def titulo_seccion(self, titulo, y=None):
+        if y is None:
+            y = PAGE_HEIGHT - 100
+        self.agregar("titulo_seccion", titulo=titulo, y=y)
+        return y - ALTO_TITULO_SECCION
+
+    def titulo_subseccion(self, titulo, y):
+        self.agregar("titulo_subseccion", titulo=titulo, y=y)
+        return y - ALTO_SUBTITULO
+
+    def imagenes(self, imagenes, per_page, start_y):
+        celdas, restantes, used_height = calcular_celdas(
+            imagenes, per_page=per_page, start_y=start_y
+        )
+        self.agregar("imagenes", celdas=celdas)
+        return restantes, used_height
+
+    def abrir_tramo(self, titulo):
+        self.cerrar_tramo()
+        self.tramos.append(
+            {"titulo": titulo, "desde": len(self.ops), "hasta": None, "pagina": self.pagina}
+        )
+
+    def cerrar_tramo(self):
+        if self.tramos and self.tramos[-1]["hasta"] is None:
+            self.tramos[-1]["hasta"] = len(self.ops)
+
+
+# ============================================================
+# PLANIFICACIÓN
+# ============================================================
+def planificar_mantenimiento(plan, tree, index=None):
+    MIN_BOTTOM = 120
+    TITLE_GAP = 2
+
+    # Convertimos a listas para saber el total y usar índices
+    secciones_list = list(tree.items())
+    total_secciones = len(secciones_list)
+
+    for i_sec, (seccion, subsecciones) in enumerate(secciones_list):
+        plan.abrir_tramo(seccion)
+        cursor_y = plan.nueva_pagina_con_titulo(seccion)
+        if index:
+            index.add(seccion, plan.pagina, level=1)
+        cursor_y -= TITLE_GAP
+
+        subsecciones_list = list(subsecciones.items())
+        total_subs = len(subsecciones_list)
+
+        for i_sub, (subseccion, grupos) in enumerate(subsecciones_list):
+            if subseccion:
+                if cursor_y < (MIN_BOTTOM + 40):
+                    cursor_y = plan.nueva_pagina_con_titulo(seccion)
+
+                cursor_y = plan.titulo_subseccion(subseccion, cursor_y)
+                if index:
+                    index.add(subseccion, plan.pagina, level=2)
+                cursor_y -= TITLE_GAP
+
+            grupos_list = list(grupos.items())
+            total_grupos = len(grupos_list)
+
+            for i_gru, (grupo, categorias) in enumerate(grupos_list):
+                if grupo:
+                    if cursor_y < (MIN_BOTTOM + 40):
+                        cursor_y = plan.nueva_pagina_con_titulo(seccion)
+
+                    cursor_y = plan.titulo_subseccion(grupo, cursor_y)
+                    if index:
+                        index.add(grupo, plan.pagina, level=3)
+                    cursor_y -= TITLE_GAP
+
+                categorias_list = list(categorias.items())
+                total_cats = len(categorias_list)
+
+                for i_cat, (categoria, imagenes_nativas) in enumerate(categorias_list):
+                    imagenes_categoria = [f for f in imagenes_nativas if f.lower().endswith((".jpg", ".jpeg", ".png"))]
+
+                    if categoria:
+                        if cursor_y < (MIN_BOTTOM + 40):
+                            cursor_y = plan.nueva_pagina_con_titulo(seccion)
+
+                        cursor_y = plan.titulo_subseccion(categoria, cursor_y)
+                        cursor_y -= TITLE_GAP
+
+                    nombre = (categoria or "").lower()
+                    layout = 2 if ("pantalla" in nombre or "pruebas" in nombre) else 4
+
+                    imagenes_temp = imagenes_categoria[:]
+                    while imagenes_temp:
+                        if cursor_y < (MIN_BOTTOM + 250):
+                            cursor_y = plan.nueva_pagina_con_titulo(seccion)
+
+                        imagenes_temp, used_height = plan.imagenes(
+                            imagenes_temp, layout, cursor_y
+                        )
+                        cursor_y -= used_height
+
+                    # --- EL SALTO DE PÁGINA INTELIGENTE ---
+                    # Solo hacemos showPage si NO es la última categoría de la última subsección del último grupo
+                    es_el_final_absoluto = (
+                        (i_sec == total_secciones - 1) and
+                        (i_sub == total_subs - 1) and
+                        (i_gru == total_grupos - 1) and
+                        (i_cat == total_cats - 1)
+                    )
+
+                    if not es_el_final_absoluto:
+                        if cursor_y < (PAGE_HEIGHT - 150):
+                            plan.abrir_tramo(seccion)
+                            cursor_y = plan.nueva_pagina_con_titulo(seccion)
+
+        plan.cerrar_tramo()
+
+    return plan
+
+
+def planificar_documentacion_links(plan, pdf_tree, index=None, nombres=None):
+    plan.salto()
+    plan.agregar("encabezado")
+
+    # 1. Espacio superior compacto
+    cursor_y = plan.titulo_seccion("Documentación Técnica", PAGE_HEIGHT - 100)
+
+    if index:
+        index.add("Documentación Técnica", plan.pagina, level=1)
+
+    # Pegamos el primer encabezado al título principal
+    cursor_y -= 5
+
+    for seccion, subsecciones in pdf_tree.items():
+        # Verificación de contenido
+        tiene_pdfs = any(
+            pdf_list
+            for sub in subsecciones.values()
+            for grupo in sub.values()
+            for pdf_list in grupo.values()
+            if pdf_list
+        )
+
+        if not tiene_pdfs:
+            continue
+
+        plan.agregar("encabezado_documentacion", titulo=limpiar_prefijo(seccion), y=cursor_y)
+
+        # 3. Más espacio entre el encabezado azul y la lista
+        cursor_y -= 25
+
+        for subseccion, grupos in subsecciones.items():
+            for grupo, categorias in grupos.items():
+                for categoria, pdfs in categorias.items():
+                    for pdf_path in pdfs:
+                        # Control de salto de página
+                        if cursor_y < 120:
+                            plan.salto()
+                            plan.agregar("encabezado")
+                            cursor_y = PAGE_HEIGHT - 100
+
+                        # Limpieza de textos de origen
+                        sub_l = limpiar_prefijo(subseccion)
+                        gru_l = limpiar_prefijo(grupo)
+                        origen = f"{sub_l} > {gru_l}" if grupo else sub_l
+
+                        plan.agregar(
+                            "link_documentacion", pdf=pdf_path, origen=origen, y=cursor_y,
+                            destino=nombres.get(pdf_path) if nombres else None,
+                        )
+
+                        # 4. Espaciado entre links aumentado
+                        cursor_y -= 22
+
+        # Espacio tras terminar una sección completa
+        cursor_y -= 10
+
+    return plan
+
+
+def planificar_reporte(data, mantenimiento_tree, pdf_tree, index, paginas_indice, registro):
+    """
+    Calcula todo el documento (saltos de página, used_height y números de
+    página del índice) a partir de la estructura de carpetas. No abre
+    imágenes: el alto de cada bloque depende solo del layout y del número
+    de fotos, no de sus píxeles. Las páginas de los PDFs de inventario se
+    cuentan con el `registro` (RegistroDocumentos) de la corrida.
+    """
+    plan = PlanPaginas()
+
+    # ---------------- PORTADA ----------------
+    # draw_cover termina con showPage()
+    plan.agregar("portada", avanza=1)
+
+    # ---------------- INTRODUCCIÓN ----------------
+    plan.agregar("encabezado")
+    plan.agregar("introduccion")
+    plan.salto()
+
+    # ---------------- ÍNDICE ----------------
+    # draw_index termina con showPage(); reservamos las páginas estimadas
+    plan.agregar("indice", avanza=paginas_indice)
+
+    # ---------------- UBICACIÓN ----------------
+    index.add("Ubicación", plan.pagina, level=1)
+    imagenes_restantes = data["ubicacion"][:]
+    if imagenes_restantes:
+        plan.abrir_tramo("Ubicación")
+
+    while imagenes_restantes:
+        plan.agregar("encabezado")
+        cursor_y = plan.titulo_seccion("Ubicación")
+        cursor_y -= 20
+
+        # Mantenemos la lógica de 1 o 2 imágenes
+        per_page = 1 if len(imagenes_restantes) == 1 else 2
+        imagenes_restantes, used_height = plan.imagenes(
+            imagenes_restantes, per_page, cursor_y
+        )
+
+        if imagenes_restantes:
+            plan.salto()
+
+    plan.cerrar_tramo()
+
+    # ---------------- INVENTARIO ----------------
+    for pdf in data["inventario"]:
+        # Página del marcador (la que tendrá el encabezado)
+        plan.salto()
+
+        if pdf == data["inventario"][0]:
+            index.add("Inventario", plan.pagina, level=1)
+
+        plan.agregar("encabezado")
+        plan.agregar("documento", pdf=pdf)
+
+        # Si el PDF tiene 5 páginas reservamos 4 "huecos" más
+        if existe_archivo(pdf):
+            for _ in range(registro.paginas(pdf) - 1):
+                plan.salto()
+
+    # ---------------- MANTENIMIENTO ----------------
+    planificar_mantenimiento(plan, mantenimiento_tree, index=index)
+
+    # --- DOCUMENTACIÓN TÉCNICA (links PDFs de mantenimiento) ---
+    # Los links apuntan al nombre con el que cada PDF va en el ZIP de entrega
+    nombres = data.get("nombres_entrega", {})
+    planificar_documentacion_links(plan, pdf_tree, index=index, nombres=nombres)
+
+    # ---------------- ANEXOS (Listado con Links) ----------------
+    plan.salto()
+    index.add("Anexos", plan.pagina, level=1)
+    plan.agregar("encabezado")
+
+    cursor_y = plan.titulo_seccion("Anexos del Proyecto", PAGE_HEIGHT - 100)
+    cursor_y -= 20
+
+    for pdf in data["anexos"]:
+        plan.agregar("link_anexo", pdf=pdf, y=cursor_y, destino=nombres.get(pdf))
+
+        cursor_y -= 25
+        if cursor_y < 120:
+            plan.salto()
+            plan.agregar("encabezado")
+            cursor_y = PAGE_HEIGHT - 120
+
+    return plan
+
+
+def _destinos_ops(plan):
+    # Op -> tramo en cuyo PDF se dibujan sus fotos (sin entrada = cuerpo)
+    destinos = {}
+    for tramo in plan.tramos:
+        for i in range(tramo["desde"], tramo["hasta"]):
+            destinos[i] = tramo["desde"]
+    return destinos
+
+
+def marcar_fotos_repetidas(plan, por_tramo=False):
+    """
+    Marca con "repetida" las celdas cuya foto (por contenido, no por nombre)
+    aparece más de una vez en el mismo PDF: dibujar_celdas la prepara e
+    incrusta una sola vez y las demás apariciones la referencian. Solo se
+    marcan las repetidas porque envolver cada foto en un form XObject
+    agrega unos cientos de bytes por imagen.
+
+    Con un solo canvas basta con la foto, aunque se repita en categorías
+    distintas. Con `por_tramo` (las fotos de cada tramo van en su propio
+    PDF, ver RenderIncremental) solo cuentan las repetidas dentro del mismo
+    tramo; entre tramos las une el ensamblado.
+    """
+    destinos = _destinos_ops(plan) if por_tramo else {}
+    grupos = {}
+    for i, op in enumerate(plan.ops):
+        if op["tipo"] != "imagenes":
+            continue
+        for celda in op["celdas"]:
+            celda.pop("repetida", None)
+            llave = (destinos.get(i), nombre_imagen(celda))
+            grupos.setdefault(llave, []).append(celda)
+
+    for (_, nombre), celdas in grupos.items():
+        if len(celdas) > 1:
+            for celda in celdas:
+                celda["repetida"] = nombre
+
+
+def planificar_con_indice(data, mantenimiento_tree, pdf_tree, registro, nuevo_indice, paginas_estimadas=1):
+    """
+    Planifica el reporte y mide el índice que resulta con las métricas de
+    draw_index. Si no ocupa las páginas reservadas, todos los números de
+    página posteriores estarían corridos: se vuelve a planificar con la
+    medida real hasta que coincidan (planificar no dibuja nada, así que
+    cada vuelta es barata). Regresa (plan, index, vueltas).
+    """
+    reservadas = paginas_estimadas
+    for vuelta in range(1, MAX_VUELTAS_INDICE + 1):
+        index = nuevo_indice()
+        plan = planificar_reporte(data, mantenimiento_tree, pdf_tree, index, reservadas, registro)
+        medidas = medir_paginas_indice(index.get_items())
+        if medidas == reservadas:
+            return plan, index, vuelta
+        print(f"📑 El índice ocupa {medidas} página(s), no {reservadas}: replanificando...")
+        reservadas = medidas
+
+    raise RuntimeError("No se pudo ajustar la paginación del índice.")
+
+
+# ============================================================
+# PESO OBJETIVO
+# ============================================================
+def estimar_bytes_fijos(plan, registro, project_data):
+    """
+    Bytes del PDF final que no dependen de cómo se codifiquen las fotos:
+    páginas del cuerpo, PDFs de inventario injertados y portada y logos
+    (ya reducidos, como se incrustan).
+    """
+    total = BYTES_FIJOS_PDF + plan.pagina * BYTES_POR_PAGINA
+
+    for op in plan.ops:
+        if op["tipo"] == "documento" and existe_archivo(op["pdf"]):
+            total += registro.tamano(op["pdf"])
+
+    return total + peso_imagenes_proyecto(project_data)
+
+
+def _pesos_naturales(fotos, dpi, calidad, workers=None):
+    """
+    Bytes de cada foto preparada sin presupuesto: lo más que puede llegar
+    a ocupar. Los resultados quedan en la caché, así que las fotos que al
+    final no necesitan presupuesto ya no se vuelven a preparar al dibujar.
+    """
+    trabajos = {}
+    for llave, celdas in fotos.items():
+        trabajos[llave] = (celdas[0]["path"], parametros_celda(
+            {"max_w": celdas[0]["max_w"], "max_h": celdas[0]["max_h"]}, dpi, calidad
+        ))
+    preparar_en_cache([(path, [parametros]) for path, parametros in trabajos.values()], workers)
+
+    pesos = {}
+    for llave, (path, parametros) in trabajos.items():
+        try:
+            pesos[llave] = prepare_image_for_pdf(path, **parametros).getbuffer().nbytes
+        except Exception:
+            # Foto ilegible: no ocupa nada (se dibujará el aviso de error)
+            pesos[llave] = 0
+    return pesos
+
+
+def repartir_peso_objetivo(plan, registro, project_data, bytes_objetivo):
+    """
+    Reparte entre las fotos del plan lo que queda de `bytes_objetivo` una
+    vez descontado lo que no son fotos, en proporción al área de su celda:
+    cada celda recibe un "presupuesto" en bytes que prepare_image_for_pdf
+    respeta. Las celdas con la misma foto al mismo tamaño (nombre_imagen)
+    cuentan una vez, porque al ensamblar quedan una sola vez.
+
+    Una foto que sin presupuesto ya pesa menos que su parte no lo necesita:
+    se queda como está y lo que le sobra se vuelve a repartir entre las
+    demás, hasta que ninguna sobra. Así una sola pasada queda cerca del
+    objetivo. Regresa los bytes repartidos.
+    """
+    disponibles = (bytes_objetivo - estimar_bytes_fijos(plan, registro, project_data)) * MARGEN_PESO
+
+    fotos = {}
+    for op in plan.ops:
+        if op["tipo"] != "imagenes":
+            continue
+        for celda in op["celdas"]:
+            fotos.setdefault(nombre_imagen(celda), []).append(celda)
+
+    if not fotos:
+        return 0
+    if disponibles < PRESUPUESTO_MINIMO * len(fotos):
+        print(f"⚠️ El peso objetivo no alcanza para {len(fotos)} fotos: "
+              f"se usará el mínimo por foto ({PRESUPUESTO_MINIMO // 1024} KB)")
+
+    dpi = project_data.get("dpi_imagenes") or DPI_IMAGENES
+    calidad = project_data.get("calidad_imagenes") or CALIDAD_IMAGENES
+    naturales = _pesos_naturales(fotos, dpi, calidad, project_data.get("workers_imagenes"))
+    areas = {llave: celdas[0]["max_w"] * celdas[0]["max_h"] for llave, celdas in fotos.items()}
+
+    # Las que caben completas salen del reparto y liberan lo que les sobra
+    pendientes = set(fotos)
+    repartidos = 0
+    sobra = True
+    while pendientes and sobra:
+        area_total = sum(areas[llave] for llave in pendientes)
+        restantes = disponibles - repartidos
+        sobra = False
+        for llave in list(pendientes):
+            if naturales[llave] <= restantes * areas[llave] / area_total:
+                pendientes.discard(llave)
+                repartidos += naturales[llave]
+                sobra = True
+
+    area_total = sum(areas[llave] for llave in pendientes)
+    restantes = disponibles - repartidos
+    for llave in pendientes:
+        presupuesto = max(PRESUPUESTO_MINIMO, int(restantes * areas[llave] / area_total))
+        repartidos += presupuesto
+        for celda in fotos[llave]:
+            celda["presupuesto"] = presupuesto
+    return repartidos
+
+
+def asignar_presupuestos(plan, registro, project_data):
+    """
+    Deja en las celdas el presupuesto que corresponde a
+    project_data["peso_objetivo_mb"] (sin peso objetivo, ninguno). El mismo
+    plan sirve así para varios perfiles de salida. Regresa los bytes
+    repartidos entre las fotos.
+    """
+    for op in plan.ops:
+        if op["tipo"] == "imagenes":
+            for celda in op["celdas"]:
+                celda.pop("presupuesto", None)
+
+    peso_objetivo_mb = project_data.get("peso_objetivo_mb")
+    if not peso_objetivo_mb:
+        return 0
+    return repartir_peso_objetivo(plan, registro, project_data, peso_objetivo_mb * 1024 * 1024)
+
+
+# ============================================================
+# PERFILES DE SALIDA
+# ============================================================
+def preparar_perfiles(plan, registro, perfiles):
+    """
+    Con varios perfiles de salida (cada uno un project_data con sus propios
+    dpi_imagenes, calidad_imagenes o peso_objetivo_mb) prepara de una vez
+    cada foto del plan para todos ellos: se lee y decodifica una sola vez y
+    se codifica una vez por perfil (ver preparar_variantes). Los resultados
+    quedan en la caché de imágenes, así que el render de cada perfil ya no
+    decodifica nada.
+    """
+    variantes = {}
+    for datos in perfiles:
+        asignar_presupuestos(plan, registro, datos)
+        dpi = datos.get("dpi_imagenes") or DPI_IMAGENES
+        calidad = datos.get("calidad_imagenes") or CALIDAD_IMAGENES
+        for path, parametros in _trabajos_prefetch(plan, set(), dpi, calidad):
+            lista = variantes.setdefault(path, [])
+            if parametros not in lista:
+                lista.append(parametros)
+
+    workers = perfiles[0].get("workers_imagenes") if perfiles else None
+    preparar_en_cache(list(variantes.items()), workers)
+    return len(variantes)
+
+
+# ============================================================
+# EJECUCIÓN
+# ============================================================
+def ejecutar_plan(c, plan, project_data, index_items, instrumentacion=None, incremental=None):
+    """
+    Dibuja el plan en el canvas real. Regresa las tareas de inserción
+    (página, ruta_pdf) de los marcadores de inventario.
+
+    Las imágenes se preparan por adelantado en procesos aparte
+    (project_data["workers_imagenes"], por defecto un proceso por núcleo);
+    el canvas solo inserta los JPEG ya listos, en el mismo orden. Cada foto
+    se decodifica y codifica a los píxeles que su celda necesita según
+    project_data["dpi_imagenes"], con project_data["calidad_imagenes"].
+
+    `instrumentacion` (opcional) recibe las mediciones por imagen.
+    `incremental` (RenderIncremental, opcional) manda las fotos de cada tramo
+    de mantenimiento a un PDF aparte y se salta los que ya están en caché.
+    Con más de un proceso y project_data["render_paralelo"] (activo por
+    defecto; main crea el RenderIncremental para eso aunque no se pida
+    "incremental") esos tramos se dibujan en paralelo en procesos aparte.
+    """
+    dpi = project_data.get("dpi_imagenes") or DPI_IMAGENES
+    calidad = project_data.get("calidad_imagenes") or CALIDAD_IMAGENES
+    workers = max(1, project_data.get("workers_imagenes") or os.cpu_count() or 1)
+
+    # Las fotos de los tramos van en PDFs aparte solo con `incremental`
+    marcar_fotos_repetidas(plan, por_tramo=incremental is not None)
+
+    omitidas = set()
+    if incremental is not None:
+        incremental.preparar(plan, dpi, calidad)
+        if project_data.get("render_paralelo", True):
+            incremental.lanzar(plan, dpi, calidad, workers)
+        omitidas = incremental.ops_omitidas()
+
+    # Si los tramos ya ocupan los procesos, lo poco que queda se prepara aquí
+    if incremental is not None and incremental.en_paralelo:
+        workers = 1
+
+    trabajos = _trabajos_prefetch(plan, omitidas, dpi, calidad, por_tramo=incremental is not None)
+    try:
+        with PrefetchImagenes(trabajos, workers=workers) as prefetch:
+            insert_tasks = _ejecutar_ops(
+                c, plan, project_data, index_items, prefetch.obtener, dpi, calidad,
+                instrumentacion, incremental,
+            )
+        if incremental is not None:
+            incremental.esperar(instrumentacion)
+    finally:
+        if incremental is not None:
+            incremental.cancelar()
+
+    return insert_tasks
+
+
+def _trabajos_prefetch(plan, omitidas, dpi, calidad, por_tramo=False):
+    """
+    Fotos a preparar, en el orden en que se dibujarán. Una foto repetida
+    que ya se incrustó en el mismo PDF (el cuerpo o el de un tramo) no se
+    vuelve a preparar en dibujar_celdas, así que tampoco se pide.
+    """
+    destinos = _destinos_ops(plan) if por_tramo else {}
+
+    trabajos = []
+    vistas = set()
+    for i, op in enumerate(plan.ops):
+        if op["tipo"] != "imagenes" or i in omitidas:
+            continue
+        for celda in op["celdas"]:
+            if celda.get("repetida"):
+                llave = (destinos.get(i), celda["repetida"])
+                if llave in vistas:
+                    continue
+                vistas.add(llave)
+            trabajos.append((celda["path"], parametros_celda(celda, dpi, calidad)))
+    return trabajos
+
+
+def _ejecutar_ops(c, plan, project_data, index_items, preparar, dpi, calidad,
+                  instrumentacion=None, incremental=None):
+    insert_tasks = []
+    tramos = incremental.tramos if incremental is not None else {}
+
+    # Canvas de las imágenes del tramo en curso (None si se reutiliza)
+    destino = None
+    tramo = None
+
+    for i, op in enumerate(plan.ops):
+        tipo = op["tipo"]
+
+        if tramo is not None and i == tramo["hasta"]:
+            incremental.cerrar(tramo, destino)
+            tramo, destino = None, None
+
+        if i in tramos:
+            # Si el tramo empieza con un salto su primera página es la siguiente
+            tramo = tramos[i]
+            if tipo == "salto":
+                c.showPage()
+                destino = incremental.abrir(tramo, c.getPageNumber())
+                continue
+            destino = incremental.abrir(tramo, c.getPageNumber())
+
+        if tipo == "salto":
+            c.showPage()
+            if tramo is not None and destino is not None:
+                destino.showPage()
+        elif tipo == "encabezado":
+            draw_header_footer(c, c.getPageNumber(), project_data)
+        elif tipo == "portada":
+            draw_cover(c, project_data, project_data)
+        elif tipo == "introduccion":
+            draw_introduccion(c, project_data["introduccion"], project_data)
+        elif tipo == "indice":
+            draw_header_footer(c, c.getPageNumber(), project_data)
+            draw_index(c, index_items, project_data)
+        elif tipo == "titulo_seccion":
+            draw_section_title(c, op["titulo"], op["y"])
+        elif tipo == "titulo_subseccion":
+            draw_subsection_title(c, op["titulo"], op["y"])
+        elif tipo == "imagenes" and tramo is None:
+            dibujar_celdas(
+                c, op["celdas"], preparar=preparar, dpi=dpi, calidad=calidad,
+                instrumentacion=instrumentacion,
+            )
+        elif tipo == "imagenes":
+            # Dentro de un tramo las fotos van a su PDF aparte (o ya están en
+            # caché) y en el cuerpo solo quedan los nombres
+            if destino is not None:
+                dibujar_celdas(
+                    destino, op["celdas"], preparar=preparar, dpi=dpi, calidad=calidad,
+                    instrumentacion=instrumentacion, textos=False,
+                )
+            dibujar_celdas(c, op["celdas"], imagenes=False)
+        elif tipo == "documento":
+            # Anotamos la página donde inicia el PDF
+            insert_tasks.append((c.getPageNumber(), op["pdf"]))
+            draw_marcador_documento(c, op["pdf"])
+        elif tipo == "encabezado_documentacion":
+            draw_encabezado_documentacion(c, op["titulo"], op["y"])
+        elif tipo == "link_documentacion":
+            draw_link_documentacion(c, op["pdf"], op["origen"], op["y"], op.get("destino"))
+        elif tipo == "link_anexo":
+            draw_link_anexo(c, op["pdf"], op["y"], op.get("destino"))
+
+    if tramo is not None:
+        incremental.cerrar(tramo, destino)
+
+    return insert_tasks
@@ -0,0 +1,38 @@
+import fitz  # PyMuPDF
+
+from file_engine import (
+    leer_archivo,
+)
+
+
+class RegistroDocumentos:
+    """
+    Registro por corrida de los PDFs externos (inventario). Cada archivo se
+    lee y se abre una sola vez con PyMuPDF; el mismo documento sirve para
+    contar páginas al planificar y para injertarlo en el ensamblado final.
+    """
+
+    def __init__(self):
+        self._documentos = {}
+        self._tamanos = {}
+
+    def documento(self, ruta):
+        if ruta not in self._documentos:
+            datos = leer_archivo(ruta)
+            self._tamanos[ruta] = len(datos)
+            self._documentos[ruta] = fitz.open(stream=datos, filetype="pdf")
+        return self._documentos[ruta]
+
+    def paginas(self, ruta):
+        return self.documento(ruta).page_count
+
+    def tamano(self, ruta):
+        """Bytes del PDF original (lo que pesará, más o menos, al injertarlo)."""
+        self.documento(ruta)
+        return self._tamanos[ruta]
+
+    def cerrar(self):
+        for doc in self._documentos.values():
+            doc.close()
+        self._documentos.clear()
+        self._tamanos.clear()
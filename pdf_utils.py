@@ -1,12 +1,22 @@
 import io
 import re
+import math
+import json
+import time
+import zlib
+import hashlib
+from contextlib import contextmanager
+from reportlab import rl_config
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.utils import ImageReader
-from PIL import Image
-from collections import defaultdict
+from PIL import Image, ImageChops
 
+import image_cache
 from file_engine import (
-    obtener_niveles,
+    arbol_por_niveles,
+    leer_archivo,
+    nombre_base,
+    huella_archivo,
 )
 
 PAGE_WIDTH, PAGE_HEIGHT = A4
@@ -14,34 +24,317 @@ MARGIN = 40
 TEXT_HEIGHT = 14
 TOP_SAFE_MARGIN = PAGE_HEIGHT - 200
 
+# Resolución objetivo de las fotos respecto al tamaño de su celda
+# (150 suficiente para pantalla, 300 para impresión)
+DPI_IMAGENES = 200
+
+# Calidad JPEG de las fotos que hay que recomprimir
+CALIDAD_IMAGENES = 65
+
+# Etiqueta EXIF de orientación (1 = tal como está guardada)
+ORIENTACION_EXIF = 0x0112
+
+# Tabla de cuantización de luminancia estándar (calidad 50, IJG)
+TABLA_LUMINANCIA = [
+    16, 11, 10, 16, 24, 40, 51, 61,
+    12, 12, 14, 19, 26, 58, 60, 55,
+    14, 13, 16, 24, 40, 57, 69, 56,
+    14, 17, 22, 29, 51, 87, 80, 62,
+    18, 22, 37, 56, 68, 109, 103, 77,
+    24, 35, 55, 64, 81, 104, 113, 92,
+    49, 64, 78, 87, 103, 121, 120, 101,
+    72, 92, 95, 98, 112, 100, 103, 99,
+]
+
+# Capturas de pantalla: en una muestra de MUESTRA_CAPTURA² píxeles, al
+# menos FRACCION_PLANA_CAPTURA iguales a su vecino y no más de
+# COLORES_MAX_CAPTURA colores (contando 4 bits por canal, para que el ruido
+# de un JPEG no cuente como colores distintos)
+MUESTRA_CAPTURA = 64
+FRACCION_PLANA_CAPTURA = 0.6
+COLORES_MAX_CAPTURA = 64
+
+FIRMA_PNG = b"\x89PNG\r\n\x1a\n"
+
+# Fotos con presupuesto de bytes (modo de peso objetivo): la calidad se
+# busca entre CALIDAD_MINIMA y la normal; si ni así cabe, la foto se achica
+# por ESCALA_PRESUPUESTO mientras su lado menor no baje de LADO_MINIMO
+CALIDAD_MINIMA = 20
+ESCALA_PRESUPUESTO = 0.75
+LADO_MINIMO = 96
+
+
+def pixeles_necesarios(size, tamano_celda, dpi):
+    """
+    Píxeles (ancho, alto) que ocupa una imagen de `size` al ajustarla dentro
+    de una celda de `tamano_celda` puntos, a `dpi` puntos por pulgada.
+    """
+    iw, ih = size
+    max_w, max_h = tamano_celda
+    scale = min(max_w / iw, max_h / ih) * dpi / 72
+    return max(1, math.ceil(iw * scale)), max(1, math.ceil(ih * scale))
 
-def prepare_image_for_pdf(path, max_width=1400, quality=65):
-    img = Image.open(path).convert("RGB")
 
-    if img.width > max_width:
-        ratio = max_width / img.width
-        img = img.resize(
-            (int(img.width * ratio), int(img.height * ratio)),
-            Image.LANCZOS
-        )
+def abrir_reducida(contenido, tamano_celda=None, dpi=DPI_IMAGENES):
+    """
+    Abre la imagen decodificando solo los píxeles que necesita la celda.
+    En JPEG usa draft() (escalado en el dominio DCT, 1/2, 1/4 o 1/8), así que
+    el decodificador nunca materializa la foto completa. En otros formatos
+    aplica reduce() antes del remuestreo fino.
+    """
+    img = Image.open(io.BytesIO(contenido))
+    if not tamano_celda:
+        return img
+
+    objetivo = pixeles_necesarios(img.size, tamano_celda, dpi)
+
+    if img.format == "JPEG":
+        img.draft("RGB", objetivo)
+        return img
 
+    factor = min(img.width // objetivo[0], img.height // objetivo[1])
+    if factor >= 2:
+        img = img.reduce(factor)
+    return img
+
+
+def calidad_jpeg(img):
+    """
+    Calidad aproximada (escala IJG 1-100) con la que se guardó un JPEG,
+    a partir de su tabla de cuantización de luminancia.
+    """
+    tabla = (getattr(img, "quantization", None) or {}).get(0)
+    if not tabla:
+        return None
+    escala = sum(q * 100 / base for q, base in zip(tabla, TABLA_LUMINANCIA)) / 64
+    return round((200 - escala) / 2) if escala <= 100 else round(5000 / escala)
+
+
+def jpeg_utilizable(img, max_width=1400, quality=CALIDAD_IMAGENES, tamano_celda=None, dpi=DPI_IMAGENES):
+    """
+    True si la foto original se puede incrustar tal cual: JPEG baseline en
+    RGB o gris, sin rotación EXIF, sin más píxeles de los que necesita su
+    celda (o `max_width`) y guardado con calidad no mayor a `quality`.
+    Solo mira el encabezado, no decodifica.
+    """
+    if img.format != "JPEG" or img.mode not in ("RGB", "L"):
+        return False
+    if img.info.get("progressive") or img.info.get("progression"):
+        return False
+    if img.getexif().get(ORIENTACION_EXIF, 1) != 1:
+        return False
+    calidad = calidad_jpeg(img)
+    # Recomprimir uno guardado con más calidad sí ahorra bytes
+    if calidad is None or calidad > quality:
+        return False
+    if tamano_celda:
+        return img.width <= pixeles_necesarios(img.size, tamano_celda, dpi)[0]
+    return img.width <= max_width
+
+
+def parece_captura(img):
+    """
+    True si la imagen parece una captura de pantalla (zonas planas, pocos
+    colores) y no una foto. Solo mira una muestra pequeña sin suavizar.
+    """
+    muestra = img.convert("RGB").resize((MUESTRA_CAPTURA, MUESTRA_CAPTURA), Image.NEAREST)
+    vecino = ImageChops.offset(muestra, 1, 0)
+    iguales = ImageChops.difference(muestra, vecino).convert("L").histogram()[0]
+    if iguales < FRACCION_PLANA_CAPTURA * MUESTRA_CAPTURA ** 2:
+        return False
+    gruesa = muestra.point([v & 0xF0 for v in range(256)] * 3)
+    return gruesa.getcolors(COLORES_MAX_CAPTURA) is not None
+
+
+def codificar_paleta(img):
+    """
+    PNG con paleta de hasta 256 colores (sin tramado, para que los bordes y
+    el texto queden nítidos). Si la imagen ya tiene 256 colores o menos, la
+    paleta es exacta.
+    """
+    paleta = img.quantize(256, method=Image.Quantize.FASTOCTREE, dither=Image.Dither.NONE)
+    buf = io.BytesIO()
+    paleta.save(buf, format="PNG")
+    paleta.close()
+    return buf
+
+
+def codificar_jpeg(img, quality):
     buf = io.BytesIO()
     img.save(buf, format="JPEG", quality=quality, optimize=True)
-    buf.seek(0)
-    img.close()
     return buf
 
 
-def draw_images(canvas, images, per_page=4, start_y=None):
-    
-    def clean_filename(name):
-        return name.lstrip("0123456789.- _").strip()
+def jpeg_en_presupuesto(img, presupuesto, quality):
+    """
+    JPEG de no más de `presupuesto` bytes con la mayor calidad posible:
+    búsqueda binaria de la calidad entre CALIDAD_MINIMA y `quality`; si ni
+    con la mínima cabe, se reduce la resolución y se vuelve a buscar. Si la
+    foto ya no se puede achicar se regresa la versión más chica.
+    """
+    while True:
+        mejor = None
+        baja, alta = CALIDAD_MINIMA, quality
+        while baja <= alta:
+            calidad = (baja + alta) // 2
+            buf = codificar_jpeg(img, calidad)
+            if buf.getbuffer().nbytes <= presupuesto:
+                mejor, baja = buf, calidad + 1
+            else:
+                alta = calidad - 1
+        if mejor is not None:
+            return mejor
+
+        ancho = int(img.width * ESCALA_PRESUPUESTO)
+        alto = int(img.height * ESCALA_PRESUPUESTO)
+        if min(ancho, alto) < LADO_MINIMO:
+            return codificar_jpeg(img, CALIDAD_MINIMA)
+        img = img.resize((ancho, alto), Image.LANCZOS)
+
+
+def prepare_image_for_pdf(path, max_width=1400, quality=CALIDAD_IMAGENES, tamano_celda=None,
+                          dpi=DPI_IMAGENES, presupuesto=None):
+    """
+    Regresa la imagen (BytesIO) lista para dibujar. Con `tamano_celda` la
+    foto se ajusta a los píxeles que esa celda necesita a `dpi`; sin celda se
+    usa el ancho fijo `max_width`. Si el JPEG original ya sirve (ver
+    jpeg_utilizable) se regresan sus bytes sin decodificar ni recomprimir.
+
+    Las fotos salen en JPEG; las capturas de pantalla (ver parece_captura)
+    en PNG con paleta, o en JPEG si la paleta falla.
+
+    Con `presupuesto` (bytes) el resultado no pasa de ese tamaño: se baja la
+    calidad y, si hace falta, la resolución (ver jpeg_en_presupuesto). Una
+    captura cuya paleta no cabe sale en JPEG.
+    """
+    return preparar_variantes(path, [{
+        "max_width": max_width,
+        "quality": quality,
+        "tamano_celda": tamano_celda,
+        "dpi": dpi,
+        "presupuesto": presupuesto,
+    }])[0]
+
+
+def _pixeles_variante(size, variante):
+    # Ancho que necesita una variante de una foto de `size` píxeles
+    if variante["tamano_celda"]:
+        return pixeles_necesarios(size, variante["tamano_celda"], variante["dpi"])[0]
+    return min(size[0], variante["max_width"])
+
+
+def _codificar_variante(img, captura, variante):
+    """
+    Ajusta la foto ya decodificada (RGB) a una variante y la codifica.
+    Regresa (BytesIO, imagen ajustada).
+    """
+    if variante["tamano_celda"]:
+        objetivo = pixeles_necesarios(img.size, variante["tamano_celda"], variante["dpi"])
+        # draft() ya pudo reducirla; nunca ampliamos
+        if img.width <= objetivo[0]:
+            objetivo = None
+    elif img.width > variante["max_width"]:
+        ratio = variante["max_width"] / img.width
+        objetivo = (int(img.width * ratio), int(img.height * ratio))
+    else:
+        objetivo = None
+
+    if objetivo:
+        img = img.resize(objetivo, Image.LANCZOS)
+
+    quality, presupuesto = variante["quality"], variante["presupuesto"]
+    if captura:
+        # Una sola codificación: el JPEG queda solo por si la paleta falla
+        # o no cabe en el presupuesto
+        try:
+            buf = codificar_paleta(img)
+        except Exception:
+            buf = None
+        if buf is not None and (not presupuesto or buf.getbuffer().nbytes <= presupuesto):
+            buf.seek(0)
+            return buf, img
+
+    buf = codificar_jpeg(img, quality)
+    if presupuesto and buf.getbuffer().nbytes > presupuesto:
+        buf = jpeg_en_presupuesto(img, presupuesto, quality - 1)
+    buf.seek(0)
+    return buf, img
+
+
+def preparar_variantes(path, variantes):
+    """
+    Prepara la misma foto con varios juegos de parámetros (los de
+    prepare_image_for_pdf, p. ej. uno por perfil de salida) leyéndola y
+    decodificándola una sola vez, al tamaño de la variante que más píxeles
+    necesita. Las demás se reducen en cascada, cada una a partir de la
+    anterior (ya más chica que la original). Regresa una lista de BytesIO
+    en el orden de `variantes`; los parámetros que falten toman los valores
+    por defecto de prepare_image_for_pdf.
+    """
+    variantes = [
+        {
+            "max_width": 1400,
+            "quality": CALIDAD_IMAGENES,
+            "tamano_celda": None,
+            "dpi": DPI_IMAGENES,
+            "presupuesto": None,
+            **variante,
+        }
+        for variante in variantes
+    ]
+    contenido = leer_archivo(path)
+    cache = image_cache.cache_imagenes
+    resultados = [None] * len(variantes)
+    pendientes = []
+
+    with Image.open(io.BytesIO(contenido)) as img:
+        size = img.size
+        for i, variante in enumerate(variantes):
+            presupuesto = variante["presupuesto"]
+            if jpeg_utilizable(
+                img, variante["max_width"], variante["quality"], variante["tamano_celda"], variante["dpi"]
+            ) and (not presupuesto or len(contenido) <= presupuesto):
+                resultados[i] = io.BytesIO(contenido)
+                continue
+
+            # Misma foto + mismos parámetros = misma imagen, aunque cambie de nombre
+            parametros = {k: v for k, v in variante.items() if k != "presupuesto"}
+            if presupuesto:
+                parametros["presupuesto"] = presupuesto
+            clave = cache.clave(contenido, **parametros)
+            datos = cache.obtener(clave)
+            if datos is not None:
+                resultados[i] = io.BytesIO(datos)
+            else:
+                pendientes.append((i, variante, clave))
+
+    if not pendientes:
+        return resultados
+
+    pendientes.sort(key=lambda p: _pixeles_variante(size, p[1]), reverse=True)
+    mayor = pendientes[0][1]
+    img = abrir_reducida(contenido, mayor["tamano_celda"], mayor["dpi"])
+
+    # Se decide con la imagen sin remuestrear: el suavizado agrega colores
+    captura = parece_captura(img)
+    img = img.convert("RGB")
+
+    for i, variante, clave in pendientes:
+        buf, img = _codificar_variante(img, captura, variante)
+        cache.guardar(clave, buf.getvalue())
+        resultados[i] = buf
+    img.close()
+    return resultados
+
 
+def calcular_celdas(images, per_page=4, start_y=None):
     """
-    Dibuja un bloque (hasta per_page imágenes) y regresa:
-      (remaining_images, used_height)
+    Calcula la geometría de un bloque (hasta per_page imágenes) sin dibujar
+    ni abrir ninguna imagen. Regresa:
+      (celdas, remaining_images, used_height)
 
-    used_height = altura REAL consumida para que el main pueda mover cursor_y correctamente.
+    Cada celda es un dict con la ruta y el rectángulo (centro y tamaño máximo)
+    que ocupará la imagen en la página.
     """
 
     if start_y is None:
@@ -80,58 +373,223 @@ def draw_images(canvas, images, per_page=4, start_y=None):
     # altura real consumida por este bloque
     used_height = top_padding + (rows * row_gap) + bottom_padding
 
-    # ------------------------------------------------------------
-    # Dibujo
-    # ------------------------------------------------------------
-    idx = 0
-    for img_path in images_to_draw:
-        try:
-            buf = prepare_image_for_pdf(img_path)
-            img_reader = ImageReader(buf)
-            iw, ih = img_reader.getSize()
-        except Exception:
-            print(f"⚠️ No se pudo cargar imagen: {img_path}")
-            idx += 1
-            continue
-
+    celdas = []
+    for idx, img_path in enumerate(images_to_draw):
         col = idx % cols
         row = idx // cols
 
-        x = x_positions[col]
-
         # Centro vertical de la celda de esa fila
         # Primera fila se coloca debajo de start_y respetando top_padding
-        cell_center_y = start_y - top_padding - (row * row_gap) - (max_h / 2)
-
-        # Escalado
-        scale = min(max_w / iw, max_h / ih)
-        draw_w = iw * scale
-        draw_h = ih * scale
-
-        # Fondo de la celda
-        canvas.setFillColorRGB(0.97, 0.97, 0.97)
-        canvas.rect(
-            x - max_w / 2,
-            cell_center_y - max_h / 2,
-            max_w,
-            max_h,
-            fill=1,
-            stroke=0,
-        )
+        celdas.append({
+            "path": img_path,
+            "x": x_positions[col],
+            "y": start_y - top_padding - (row * row_gap) - (max_h / 2),
+            "max_w": max_w,
+            "max_h": max_h,
+        })
+
+    return celdas, remaining_images, used_height
+
+
+def parametros_celda(celda, dpi=DPI_IMAGENES, calidad=CALIDAD_IMAGENES):
+    # Lo que prepare_image_for_pdf necesita saber de la celda destino
+    parametros = {"tamano_celda": (celda["max_w"], celda["max_h"]), "dpi": dpi, "quality": calidad}
+    if celda.get("presupuesto"):
+        parametros["presupuesto"] = celda["presupuesto"]
+    return parametros
+
+
+@contextmanager
+def streams_binarios():
+    """
+    Mientras dure, los canvas de ReportLab escriben imágenes y páginas en
+    binario en lugar de ASCII85 (que las agranda un 25% y tarda en
+    codificarse). ReportLab lo lee al cargar cada imagen y al guardar, así
+    que debe abarcar desde que se crea el canvas hasta su save().
+    """
+    anterior = rl_config.useA85
+    rl_config.useA85 = 0
+    try:
+        yield
+    finally:
+        rl_config.useA85 = anterior
+
+
+def imagen_paleta_en_linea(datos):
+    """
+    Imagen en línea (BI ... EI) con espacio de color indexado a partir de
+    un PNG con paleta: un byte por píxel en lugar de los tres del RGB en el
+    que ReportLab convertiría el PNG. El contenido de un canvas es texto,
+    así que los datos van en hexadecimal; al ensamblar, cada form con una de
+    estas imágenes se cambia por un /Image con los datos en binario (ver
+    pdf_assembly.paletas_a_imagenes).
+    """
+    with Image.open(io.BytesIO(datos)) as img:
+        ancho, alto = img.size
+        paleta = bytes(img.getpalette("RGB"))
+        # Sin predictor: al ensamblar, PyMuPDF recomprime y descarta DecodeParms
+        indices = zlib.compress(img.tobytes())
+    return (
+        f"BI /W {ancho} /H {alto} /BPC 8 "
+        f"/CS [/I /RGB {len(paleta) // 3 - 1} <{paleta.hex()}>] /F [/AHx /Fl] "
+        f"ID {indices.hex()}>\nEI"
+    )
 
-        # Imagen
+
+def es_png_paleta(buf):
+    # Firma PNG y, en el encabezado IHDR, color tipo 3 (paleta)
+    datos = buf.getbuffer()
+    return bytes(datos[:8]) == FIRMA_PNG and bytes(datos[12:16]) == b"IHDR" and datos[25] == 3
+
+
+def dibujar_imagen(canvas, buf, img_reader, x, y, width, height):
+    """
+    drawImage, salvo para los PNG con paleta (ver codificar_paleta), que se
+    incrustan en un form con la imagen en línea (imagen_paleta_en_linea)
+    que al ensamblar se vuelve un /Image indexado. Igual que drawImage, la
+    misma imagen se incrusta una sola vez por canvas.
+    """
+    if not es_png_paleta(buf):
         canvas.drawImage(
-            img_reader,
-            x - draw_w / 2,
-            cell_center_y - draw_h / 2,
-            width=draw_w,
-            height=draw_h,
-            preserveAspectRatio=True,
-            mask="auto",
+            img_reader, x, y, width=width, height=height,
+            preserveAspectRatio=True, mask="auto",
         )
+        return
+
+    datos = buf.getvalue()
+    nombre = "paleta_" + hashlib.sha1(datos).hexdigest()
+    if not canvas.hasForm(nombre):
+        # Una imagen se pinta en el cuadro unitario
+        canvas.beginForm(nombre, 0, 0, 1, 1)
+        canvas.addLiteral(imagen_paleta_en_linea(datos))
+        canvas.endForm()
+
+    canvas.saveState()
+    canvas.translate(x, y)
+    canvas.scale(width, height)
+    canvas.doForm(nombre)
+    canvas.restoreState()
+
+
+def nombre_imagen(celda):
+    """
+    Nombre con el que una foto se guarda una sola vez dentro de un PDF:
+    misma huella de contenido y mismo tamaño de celda dan el mismo nombre
+    aunque la foto venga de otra carpeta o se llame distinto.
+    """
+    huella = huella_archivo(celda["path"]) or celda["path"]
+    contenido = json.dumps([huella, celda["max_w"], celda["max_h"]])
+    return "foto_" + hashlib.sha1(contenido.encode("utf-8")).hexdigest()[:24]
+
+
+def dibujar_celdas(canvas, celdas, preparar=None, dpi=DPI_IMAGENES, instrumentacion=None,
+                   imagenes=True, textos=True, calidad=CALIDAD_IMAGENES):
+    """
+    Dibuja las celdas calculadas por calcular_celdas. `preparar` recibe la
+    ruta y los parámetros de parametros_celda() (con `dpi` y `calidad`) y
+    regresa la imagen lista (por defecto prepare_image_for_pdf). Si se pasa
+    `instrumentacion`, se mide la preparación y el dibujo de cada imagen.
+
+    Las celdas con "repetida" (ver nombre_imagen) se guardan como form
+    XObject: si la misma foto vuelve a aparecer en este canvas no se vuelve
+    a preparar ni a incrustar, solo se pone otra referencia al mismo objeto.
+
+    Con `imagenes` o `textos` en False se dibuja solo la otra parte (fondo e
+    imagen, o el nombre debajo), p. ej. para poner las fotos en otro PDF.
+    """
+    if preparar is None:
+        preparar = prepare_image_for_pdf
+
+    def clean_filename(name):
+        return name.lstrip("0123456789.- _").strip()
+
+    for celda in celdas:
+        img_path = celda["path"]
+        x, cell_center_y = celda["x"], celda["y"]
+        max_w, max_h = celda["max_w"], celda["max_h"]
+
+        if imagenes:
+            # Las fotos que el plan marcó como repetidas se incrustan una sola
+            # vez como form XObject y después solo se vuelven a referenciar
+            nombre = celda.get("repetida")
+            buf = None
+
+            if nombre and canvas.hasForm(nombre):
+                if instrumentacion:
+                    instrumentacion.contar("imagenes_repetidas")
+                t = time.perf_counter()
+            else:
+                t = time.perf_counter()
+                try:
+                    buf = preparar(img_path, **parametros_celda(celda, dpi, calidad))
+                    img_reader = ImageReader(buf)
+                    iw, ih = img_reader.getSize()
+                except Exception:
+                    print(f"⚠️ No se pudo cargar imagen: {img_path}")
+                    if instrumentacion:
+                        instrumentacion.contar("imagenes_fallidas")
+                    continue
+
+                if instrumentacion:
+                    instrumentacion.medir("imagen_preparar", time.perf_counter() - t)
+                    instrumentacion.contar("imagenes_dibujadas")
+                    instrumentacion.contar("bytes_imagenes", buf.getbuffer().nbytes)
+                t = time.perf_counter()
+
+                # Escalado
+                scale = min(max_w / iw, max_h / ih)
+                draw_w = iw * scale
+                draw_h = ih * scale
+
+                if nombre:
+                    # Centrada en el origen del form; al usarla se traslada
+                    # al centro de la celda
+                    canvas.beginForm(nombre, -max_w / 2, -max_h / 2, max_w / 2, max_h / 2)
+                    dibujar_imagen(canvas, buf, img_reader, -draw_w / 2, -draw_h / 2, draw_w, draw_h)
+                    canvas.endForm()
+
+            # Fondo de la celda
+            canvas.setFillColorRGB(0.97, 0.97, 0.97)
+            canvas.rect(
+                x - max_w / 2,
+                cell_center_y - max_h / 2,
+                max_w,
+                max_h,
+                fill=1,
+                stroke=0,
+            )
+
+            # Imagen
+            if nombre:
+                canvas.saveState()
+                canvas.translate(x, cell_center_y)
+                canvas.doForm(nombre)
+                canvas.restoreState()
+            else:
+                dibujar_imagen(
+                    canvas,
+                    buf,
+                    img_reader,
+                    x - draw_w / 2,
+                    cell_center_y - draw_h / 2,
+                    draw_w,
+                    draw_h,
+                )
+
+            if instrumentacion:
+                instrumentacion.medir("imagen_dibujar", time.perf_counter() - t)
+
+            if buf is not None:
+                try:
+                    buf.close()
+                except Exception:
+                    pass
+
+        if not textos:
+            continue
 
         # Texto (nombre archivo)
-        raw_name = img_path.split("\\")[-1].rsplit(".", 1)[0]
+        raw_name = nombre_base(img_path).rsplit(".", 1)[0]
         filename = clean_filename(raw_name)
         tiene_letras = bool(re.search('[a-zA-Z]', filename))
 
@@ -144,33 +602,7 @@ def draw_images(canvas, images, per_page=4, start_y=None):
                 filename,
             )
 
-        try:
-            buf.close()
-        except Exception:
-            pass
-
-        idx += 1
-
-    return remaining_images, used_height
-
-def build_pdf_tree(archivos, raiz):
-    tree = defaultdict(
-        lambda: defaultdict(lambda: defaultdict(lambda: defaultdict(list)))
-    )
-
-    for archivo in archivos:
-        if not archivo.lower().endswith(".pdf"):
-            continue
 
-        niveles = obtener_niveles(archivo, raiz)
-        tree[
-            niveles["seccion"]
-        ][
-            niveles["subseccion"]
-        ][
-            niveles["grupo"]
-        ][
-            niveles["categoria"]
-        ].append(archivo)
-
-    return tree
+def build_pdf_tree(archivos, raiz, niveles=None):
+    pdfs = [archivo for archivo in archivos if archivo.lower().endswith(".pdf")]
+    return arbol_por_niveles(pdfs, raiz, niveles)